@@ -0,0 +1,59 @@
+## Synthetic leagues for the benchmarks:  generates players and games and loads them into a scratch database created
+## from the configured backend's schema.  Loading DROPs and recreates every table, so point the config at a database
+## used for nothing else.
+
+import datetime
+import random
+import re
+import time
+
+import statsServer
+
+## Returns (player names, games); each game is (timestamp, redScore, blackScore, redDefense, redOffense, blackDefense,
+## blackOffense) with player ids 1..numPlayers, timestamps spread evenly at random over the last `days` days.
+def generateLeague(numPlayers, numGames, soloFraction = 0.3, days = 365, seed = 1):
+    rng = random.Random(seed)
+    names = [ "player" + str(i) for i in range(1, numPlayers + 1) ]
+    now = datetime.datetime.now()
+    games = []
+    for i in range(numGames):
+        players = rng.sample(range(1, numPlayers + 1), 4)
+        if (rng.random() < soloFraction):
+            players[1] = players[0]
+            players[3] = players[2]
+        timestamp = now - datetime.timedelta(seconds=rng.randint(0, days * 86400))
+        games.append((timestamp.strftime("%Y-%m-%d %H:%M:%S"), rng.randint(0, 5), rng.randint(0, 5)) + tuple(players))
+    games.sort()
+    return (names, games)
+
+
+## The configured storage backend's schema (foosball.sql, or foosball_sqlite.sql for SQLite).
+def schemaStatements():
+    with open(statsServer._storage().schemaFile) as f:
+        sql = re.sub("--[^\n]*", "", f.read())
+    return [ statement.strip() for statement in sql.split(";") if (len(statement.strip()) > 0  and  not statement.strip().upper().startswith("USE ")) ]
+
+
+def createSchema(db):
+    cursor = db.cursor()
+    for statement in schemaStatements():
+        cursor.execute(statement)
+    db.commit()
+
+
+## Loads the league and fills the summary, team, participant and rating tables as rebuildStats would.  Returns the
+## seconds spent loading games and rebuilding.
+def loadLeague(db, names, games, chunkSize = 5000):
+    start = time.time()
+    createSchema(db)
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO Player (name) VALUES (%s)", [ (name,) for name in names ])
+    for i in range(0, len(games), chunkSize):
+        cursor.executemany("INSERT INTO Game (timestamp, recordedBy, redScore, blackScore, redDefense, redOffense, blackDefense, blackOffense) " \
+                           "VALUES (%s, 'benchmark', %s, %s, %s, %s, %s, %s)", games[i:i + chunkSize])
+    db.commit()
+    loaded = time.time()
+    if (statsServer._rebuildStats([ "rebuildStats" ], db, "benchmark") != "Stats rebuilt."):
+        raise Exception("rebuildStats failed; see the server log.")
+    return (loaded - start, time.time() - loaded)
+
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+## Load harness for the /slack route:  replays signed slash-command payloads (stats, recent, game, ...) at a given
+## concurrency and mix, with a local stub standing in for Slack's chat.postMessage and response_url endpoints, and prints
+## throughput and p50/p95/p99 latency per command, including the fraction of requests over Slack's 3 second limit, as JSON.
+##
+## By default the app runs in this process on a threaded server, using a copy of --config pointed at the stub (and with a
+## signing secret set, so the signature check is exercised).  With --url it drives a server that is already running; set
+## that server's slack.apiURL to the stub address this prints, and pass its token, team domain and signing secret.
+## With --loadGames N the config's database is first wiped and loaded with a synthetic league (in-process mode only).
+##
+## Usage:  python benchmarks/slackLoad.py --config bench.cfg [--requests 500] [--concurrency 8]
+##                                       [--mix stats=3,statsPlayer=3,statsPair=1,recent=2,game=1] [--loadGames 0]
+##                                       [--url http://host:port/path] [--stubPort 0] [--stubDelay 0.0] [--seed 1]
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import urlencode
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlencode
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import statsServer
+import league
+
+SLACK_DEADLINE = 3.0
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+## Stub for chat.postMessage (and response_url):  answers {"ok": true} after an optional delay and counts calls per path.
+class SlackStub(object):
+    def __init__(self, port = 0, delay = 0.0):
+        stub = self
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.delay = delay
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if (stub.delay > 0):
+                    time.sleep(stub.delay)
+                with stub.lock:
+                    stub.calls[self.path] = stub.calls.get(self.path, 0) + 1
+                body = b'{"ok": true}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever, name="SlackStub")
+        thread.daemon = True
+        thread.start()
+
+    def statistics(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+def signedRequest(secret, fields):
+    body = urlencode(fields)
+    timestamp = str(int(time.time()))
+    headers = { "Content-Type" : "application/x-www-form-urlencoded" }
+    if (len(secret) > 0):
+        base = ("v0:" + timestamp + ":" + body).encode("utf-8")
+        headers["X-Slack-Request-Timestamp"] = timestamp
+        headers["X-Slack-Signature"] = "v0=" + hmac.new(secret.encode("utf-8"), base, hashlib.sha256).hexdigest()
+    return (body, headers)
+
+
+def commandText(kind, players, rng):
+    if (kind == "stats"):
+        return "stats"
+    elif (kind == "statsPlayer"):
+        return "stats " + rng.choice(players)
+    elif (kind == "statsPair"):
+        return "stats " + " ".join(rng.sample(players, 2))
+    elif (kind == "recent"):
+        return "recent"
+    elif (kind == "game"):
+        (red, black) = rng.sample(players, 2)
+        return "game " + red + "(red):" + str(rng.randint(0, 5)) + " " + black + "(black):" + str(rng.randint(0, 5))
+    raise ValueError("unknown command kind '" + kind + "'")
+
+
+def parseMix(txt):
+    mix = []
+    for part in txt.split(","):
+        (kind, weight) = part.split("=")
+        mix.append((kind.strip(), float(weight)))
+    return mix
+
+
+def percentile(sortedSeconds, fraction):
+    return sortedSeconds[min(len(sortedSeconds) - 1, int(len(sortedSeconds) * fraction))]
+
+
+def report(results):
+    seconds = sorted(r[0] for r in results)
+    return { "requests" : len(results), \
+             "errors" : sum(1 for r in results if (not r[1])), \
+             "deferred" : sum(1 for r in results if (r[2])), \
+             "p50Seconds" : round(percentile(seconds, 0.50), 4), \
+             "p95Seconds" : round(percentile(seconds, 0.95), 4), \
+             "p99Seconds" : round(percentile(seconds, 0.99), 4), \
+             "maxSeconds" : round(seconds[-1], 4), \
+             "overDeadline" : round(float(sum(1 for s in seconds if (s > SLACK_DEADLINE))) / len(seconds), 4) }
+
+
+## Copies the config with the Slack settings pointed at the stub, for the in-process server.
+def harnessConfig(configFile, stub, signingSecret):
+    with open(configFile) as f:
+        config = json.load(f)
+    config["slack"]["apiURL"] = stub.url + "/api/chat.postMessage"
+    config["slack"]["signingSecret"] = signingSecret
+    (fd, path) = tempfile.mkstemp(suffix=".cfg")
+    with os.fdopen(fd, "w") as f:
+        json.dump(config, f)
+    return (path, config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay signed Slack slash-command traffic against the app.")
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--url", default=None, help="drive an already running server instead of an in-process one")
+    parser.add_argument("--token", default=None, help="teamPayloadToken (default: from --config)")
+    parser.add_argument("--teamDomain", default=None, help="teamDomain (default: from --config)")
+    parser.add_argument("--signingSecret", default="load-harness-secret")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default="stats=3,statsPlayer=3,statsPair=1,recent=2,game=1")
+    parser.add_argument("--loadGames", type=int, default=0, help="wipe and load a synthetic league with this many games first")
+    parser.add_argument("--players", type=int, default=50, help="players in the synthetic league")
+    parser.add_argument("--stubPort", type=int, default=0)
+    parser.add_argument("--stubDelay", type=float, default=0.0, help="seconds the stub takes per call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = SlackStub(args.stubPort, args.stubDelay)
+    server = None
+    configFile = None
+    try:
+        if (args.url is None):
+            (configFile, config) = harnessConfig(args.config, stub, args.signingSecret)
+            statsServer._g_configFile = configFile
+            statsServer._startup()
+            if (args.loadGames > 0):
+                (names, games) = league.generateLeague(args.players, args.loadGames, seed=args.seed)
+                with statsServer.app.app_context():
+                    db = statsServer._connectDB()
+                    try:
+                        league.loadLeague(db, names, games)
+                    finally:
+                        db.close()
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)         ## No per-request access log lines.
+            server = make_server("127.0.0.1", 0, statsServer.app, threaded=True)
+            thread = threading.Thread(target=server.serve_forever, name="Server")
+            thread.daemon = True
+            thread.start()
+            url = "http://127.0.0.1:" + str(server.server_port)
+        else:
+            with open(args.config) as f:
+                config = json.load(f)
+            url = args.url.rstrip("/")
+            sys.stderr.write("Slack stub listening at " + stub.url + "/api/chat.postMessage\n")
+        token = args.token if (args.token is not None) else config["slack"]["teamPayloadToken"]
+        teamDomain = args.teamDomain if (args.teamDomain is not None) else config["slack"]["teamDomain"]
+
+        players = requests.get(url + "/players").json()["players"]
+        if (len(players) < 2):
+            raise Exception("Need at least two players; use --loadGames to load a synthetic league.")
+        rng = random.Random(args.seed)
+        mix = parseMix(args.mix)
+        total = sum(weight for (kind, weight) in mix)
+        work = []
+        for i in range(args.requests):
+            pick = rng.random() * total
+            for (kind, weight) in mix:
+                pick -= weight
+                if (pick <= 0):
+                    break
+            work.append((kind, commandText(kind, players, rng)))
+
+        results = {}
+        lock = threading.Lock()
+        position = [ 0 ]
+
+        def worker():
+            session = requests.Session()
+            while True:
+                with lock:
+                    if (position[0] >= len(work)):
+                        return
+                    (kind, text) = work[position[0]]
+                    position[0] += 1
+                fields = { "token" : token, "team_domain" : teamDomain, "user_name" : "loadtest", "command" : "/foosball", \
+                           "text" : text, "response_url" : stub.url + "/response" }
+                (body, headers) = signedRequest(args.signingSecret, fields)
+                start = time.time()
+                try:
+                    r = session.post(url + "/slack", data=body, headers=headers, timeout=60)
+                    ok = (r.status_code == 200  and  r.text != "Error!")
+                    deferred = (r.text == "Working on it...")
+                except Exception:
+                    (ok, deferred) = (False, False)
+                seconds = time.time() - start
+                with lock:
+                    results.setdefault(kind, []).append((seconds, ok, deferred))
+
+        start = time.time()
+        threads = [ threading.Thread(target=worker) for i in range(args.concurrency) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        if (server is not None):
+            statsServer._flushSlackQueue()
+            server.shutdown()
+
+        allResults = [ r for kindResults in results.values() for r in kindResults ]
+        print(json.dumps({ "url" : args.url, "requests" : len(allResults), "concurrency" : args.concurrency, "mix" : args.mix, \
+                           "seconds" : round(elapsed, 3), "throughput" : round(len(allResults) / elapsed, 2) if (elapsed > 0) else None, \
+                           "overall" : report(allResults), \
+                           "commands" : dict((kind, report(kindResults)) for (kind, kindResults) in results.items()), \
+                           "slackStubCalls" : stub.statistics() }, sort_keys=True))
+    finally:
+        if (configFile is not None):
+            os.remove(configFile)            ## It holds the signing secret.
+
+
+if __name__ == "__main__":
+    main()
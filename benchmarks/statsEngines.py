@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+## Compares the python and NumPy stats engines (_tallyGames and _tallyGamesNumpy) on a synthetic in-memory league,
+## checks that they produce identical stats (every category, partner and single-opponent tally; the NumPy engine
+## skips tallies against two-player teams), and prints the timings as JSON.
+##
+## Usage:  python benchmarks/statsEngines.py [--games 1000000] [--players 200] [--soloFraction 0.3] [--seed 1]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import numpy
+import statsServer
+
+
+def syntheticGames(numGames, numPlayers, soloFraction, seed):
+    rng = numpy.random.RandomState(seed)
+    games = numpy.zeros((numGames, 6), dtype=numpy.int64)
+    ## Four distinct players per game; solo games reuse the offense player on defense.
+    players = numpy.argsort(rng.random_sample((numGames, numPlayers)), axis=1)[:, :4] + 1 if (numPlayers <= 64) \
+              else _distinctPlayers(rng, numGames, numPlayers)
+    solo = rng.random_sample(numGames) < soloFraction
+    games[:, 0] = rng.randint(0, 6, numGames)
+    games[:, 1] = rng.randint(0, 6, numGames)
+    games[:, 2] = players[:, 0]
+    games[:, 3] = numpy.where(solo, players[:, 0], players[:, 1])
+    games[:, 4] = players[:, 2]
+    games[:, 5] = numpy.where(solo, players[:, 2], players[:, 3])
+    return games
+
+
+def _distinctPlayers(rng, numGames, numPlayers):
+    players = rng.randint(1, numPlayers + 1, (numGames, 4))
+    while True:
+        clash = numpy.zeros(numGames, dtype=bool)
+        for i in range(4):
+            for j in range(i + 1, 4):
+                clash |= (players[:, i] == players[:, j])
+        if (not clash.any()):
+            return players
+        players[clash] = rng.randint(1, numPlayers + 1, (int(clash.sum()), 4))
+
+
+def newStats(numPlayers):
+    statsById = {}
+    for playerId in range(1, numPlayers + 1):
+        statsById[playerId] = statsServer.PlayerStats("player" + str(playerId), playerId)
+    return statsById
+
+
+def fingerprint(statsById):
+    result = []
+    for playerId in sorted(statsById):
+        ps = statsById[playerId]
+        opponents = [ item for item in ps.opponents.items() if (not isinstance(item[0], tuple)) ]
+        result.append((json.dumps(ps.toDictionary()), sorted(ps.partners.items()), sorted(opponents)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the python and NumPy stats engines.")
+    parser.add_argument("--games", type=int, default=1000000)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--soloFraction", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    games = syntheticGames(args.games, args.players, args.soloFraction, args.seed)
+    rows = [tuple(row) for row in games.tolist()]
+
+    pythonStats = newStats(args.players)
+    start = time.time()
+    statsServer._tallyGames(pythonStats, rows)
+    pythonSeconds = time.time() - start
+
+    numpyStats = newStats(args.players)
+    start = time.time()
+    statsServer._tallyGamesNumpy(numpyStats, games)
+    numpySeconds = time.time() - start
+
+    print(json.dumps({ "games" : args.games, "players" : args.players, "soloFraction" : args.soloFraction, \
+                       "pythonSeconds" : round(pythonSeconds, 3), "numpySeconds" : round(numpySeconds, 3), \
+                       "speedup" : round(pythonSeconds / numpySeconds, 1) if (numpySeconds > 0) else None, \
+                       "identical" : fingerprint(pythonStats) == fingerprint(numpyStats) }))
+
+
+if __name__ == "__main__":
+    main()
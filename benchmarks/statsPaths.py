@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+## Times the server's stats paths against a synthetic league loaded into a scratch database:  all-player, single-player
+## and pair stats (all-time from the summary tables, and over a time range by tallying games), recent games, and
+## recording a game.  Handlers are called directly, so the response cache and snapshot are not involved, and Slack
+## posting is switched off.  Prints one JSON object, so runs can be saved and compared.
+##
+## The config's database (MySQL or SQLite) is wiped and reloaded from its schema:  use a database that holds nothing else.
+##
+## Usage:  python benchmarks/statsPaths.py --config bench.cfg [--players 50] [--games 100000] [--soloFraction 0.3]
+##                                        [--days 365] [--seed 1] [--repeat 20] [--inserts 200] [--rangeDays 30]
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import statsServer
+import league
+
+
+def summarize(seconds):
+    seconds = sorted(seconds)
+    return { "runs" : len(seconds), \
+             "minSeconds" : round(seconds[0], 6), \
+             "medianSeconds" : round(seconds[len(seconds) // 2], 6), \
+             "meanSeconds" : round(sum(seconds) / len(seconds), 6), \
+             "p95Seconds" : round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], 6), \
+             "maxSeconds" : round(seconds[-1], 6) }
+
+
+## Runs fn(db) `repeat` times on a fresh pooled connection each time, as a request would.
+def timePath(fn, repeat):
+    seconds = []
+    for i in range(repeat):
+        db = statsServer._connectDB()
+        try:
+            start = time.time()
+            fn(db)
+            seconds.append(time.time() - start)
+        finally:
+            db.close()
+    return summarize(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stats, recent and game paths on a synthetic league.")
+    parser.add_argument("--config", required=True, help="config file whose database will be wiped and loaded")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--soloFraction", type=float, default=0.3, help="fraction of 1v1 games")
+    parser.add_argument("--days", type=int, default=365, help="games are spread over this many days")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per read path")
+    parser.add_argument("--inserts", type=int, default=200, help="games recorded for the insert path")
+    parser.add_argument("--rangeDays", type=int, default=30, help="time range used for the ranged paths")
+    args = parser.parse_args()
+
+    statsServer._g_configFile = args.config
+    statsServer._startup()
+    statsServer._postSlackMessage = lambda msg: None
+
+    (names, games) = league.generateLeague(args.players, args.games, args.soloFraction, args.days, args.seed)
+    with statsServer.app.app_context():
+        db = statsServer._connectDB()
+        try:
+            (loadSeconds, rebuildSeconds) = league.loadLeague(db, names, games)
+        finally:
+            db.close()
+
+        rng = random.Random(args.seed)
+        (player, other) = rng.sample(names, 2)
+        since = "from:" + (datetime.date.today() - datetime.timedelta(days=args.rangeDays)).strftime("%Y-%m-%d")
+        paths = [
+            ("allPlayers", [ "stats" ]),
+            ("allPlayersRange", [ "stats", since ]),
+            ("singlePlayer", [ "stats", player ]),
+            ("singlePlayerRange", [ "stats", player, since ]),
+            ("pair", [ "stats", player, other ]),
+            ("pairRange", [ "stats", player, other, since ]),
+        ]
+        results = {}
+        for (name, commandArgs) in paths:
+            results[name] = timePath(lambda db: statsServer._stats(list(commandArgs), db, "benchmark", "web"), args.repeat)
+        results["recent"] = timePath(lambda db: statsServer._recent([ "recent", "days:" + str(args.rangeDays) ], db, "benchmark", "web"), args.repeat)
+
+        def recordGame(db):
+            (red, black) = rng.sample(names, 2)
+            result = statsServer._game([ "game", red + "(red):" + str(rng.randint(0, 5)), black + "(black):" + str(rng.randint(0, 5)) ], db, "benchmark")
+            if (result != "Game recorded."):
+                raise Exception("Recording a game failed:  " + result)
+        results["gameInsert"] = timePath(recordGame, args.inserts)
+
+    print(json.dumps({ "players" : args.players, "games" : args.games, "soloFraction" : args.soloFraction, "days" : args.days, \
+                       "seed" : args.seed, "rangeDays" : args.rangeDays, "statsEngine" : statsServer._statsEngine(), \
+                       "storage" : statsServer._storage().name, \
+                       "loadSeconds" : round(loadSeconds, 3), "rebuildSeconds" : round(rebuildSeconds, 3), \
+                       "paths" : results }, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 USE Foosball;
 
 
+DROP TABLE IF EXISTS TeamVersusSummary;
+DROP TABLE IF EXISTS TeamSummary;
+DROP TABLE IF EXISTS Metadata;
+DROP TABLE IF EXISTS GameParticipant;
+DROP TABLE IF EXISTS RatingState;
+DROP TABLE IF EXISTS Rating;
+DROP TABLE IF EXISTS PairSummary;
+DROP TABLE IF EXISTS PlayerSummary;
 DROP TABLE IF EXISTS Game;
 DROP TABLE IF EXISTS Player;
 
@@ -9,7 +17,7 @@ CREATE TABLE Player (
     id INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
     name VARCHAR(256) NOT NULL,
     UNIQUE INDEX index_Player_name (name)
-);
+) DEFAULT CHARSET=utf8mb4;
 
 
 CREATE TABLE Game (
@@ -29,6 +37,105 @@ CREATE TABLE Game (
     INDEX index_Game_redDefense (redDefense),
     INDEX index_Game_redOffense (redOffense),
     INDEX index_Game_blackDefense (blackDefense),
-    INDEX index_Game_blackOffense (blackOffense)
+    INDEX index_Game_blackOffense (blackOffense),
+    INDEX index_Game_timestamp (timestamp)
+) DEFAULT CHARSET=utf8mb4;
+
+
+CREATE TABLE PlayerSummary (
+    playerId INT NOT NULL,
+    rel VARCHAR(16) NOT NULL,
+    rval VARCHAR(16) NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, rval),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE
 );
 
+
+CREATE TABLE PairSummary (
+    playerId INT NOT NULL,
+    rel VARCHAR(16) NOT NULL,
+    otherId INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, otherId),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (otherId) REFERENCES Player(id) ON UPDATE CASCADE
+);
+
+
+CREATE TABLE Rating (
+    playerId INT NOT NULL PRIMARY KEY,
+    rating DOUBLE NOT NULL,
+    gamesRated INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_Rating_rating (rating)
+);
+
+
+CREATE TABLE RatingState (
+    id INT NOT NULL PRIMARY KEY,
+    lastGameId INT NOT NULL
+);
+
+
+CREATE TABLE GameParticipant (
+    gameId INT NOT NULL,
+    playerId INT NOT NULL,
+    color VARCHAR(8) NOT NULL,
+    position CHAR(1) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    PRIMARY KEY (gameId, playerId, color, position),
+    FOREIGN KEY (gameId) REFERENCES Game(id),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_GameParticipant_player_timestamp (playerId, timestamp)
+);
+
+
+CREATE TABLE Metadata (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+INSERT INTO Metadata (name, value) VALUES ('playerVersion', 1);
+
+
+CREATE TABLE TeamSummary (
+    player1Id INT NOT NULL,
+    player2Id INT NOT NULL,
+    defenseId INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, defenseId),
+    FOREIGN KEY (player1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (player2Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_TeamSummary_defenseId (defenseId)
+);
+
+
+CREATE TABLE TeamVersusSummary (
+    player1Id INT NOT NULL,
+    player2Id INT NOT NULL,
+    opponent1Id INT NOT NULL,
+    opponent2Id INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, opponent1Id, opponent2Id),
+    FOREIGN KEY (player1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (player2Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (opponent1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (opponent2Id) REFERENCES Player(id) ON UPDATE CASCADE
+);
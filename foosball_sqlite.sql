@@ -0,0 +1,130 @@
+-- foosball.sql for the embedded SQLite backend ("backend" : "sqlite").  The server creates a new database file from this
+-- on first connect; running it by hand (sqlite3 foosball.db < foosball_sqlite.sql) drops and recreates every table.
+
+
+DROP TABLE IF EXISTS TeamVersusSummary;
+DROP TABLE IF EXISTS TeamSummary;
+DROP TABLE IF EXISTS Metadata;
+DROP TABLE IF EXISTS GameParticipant;
+DROP TABLE IF EXISTS RatingState;
+DROP TABLE IF EXISTS Rating;
+DROP TABLE IF EXISTS PairSummary;
+DROP TABLE IF EXISTS PlayerSummary;
+DROP TABLE IF EXISTS Game;
+DROP TABLE IF EXISTS Player;
+
+
+-- NOCASE matches names case-insensitively, as MySQL's default collation does.
+CREATE TABLE Player (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(256) NOT NULL COLLATE NOCASE UNIQUE
+);
+
+
+CREATE TABLE Game (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp DATETIME NOT NULL,
+    recordedBy VARCHAR(256) NOT NULL,
+    redScore INT NOT NULL,
+    blackScore INT NOT NULL,
+    redDefense INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    redOffense INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    blackDefense INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    blackOffense INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE
+);
+
+CREATE INDEX index_Game_redDefense ON Game (redDefense);
+CREATE INDEX index_Game_redOffense ON Game (redOffense);
+CREATE INDEX index_Game_blackDefense ON Game (blackDefense);
+CREATE INDEX index_Game_blackOffense ON Game (blackOffense);
+CREATE INDEX index_Game_timestamp ON Game (timestamp);
+
+
+CREATE TABLE PlayerSummary (
+    playerId INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    rel VARCHAR(16) NOT NULL,
+    rval VARCHAR(16) NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, rval)
+);
+
+
+CREATE TABLE PairSummary (
+    playerId INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    rel VARCHAR(16) NOT NULL,
+    otherId INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, otherId)
+);
+
+
+CREATE TABLE Rating (
+    playerId INT NOT NULL PRIMARY KEY REFERENCES Player(id) ON UPDATE CASCADE,
+    rating DOUBLE NOT NULL,
+    gamesRated INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX index_Rating_rating ON Rating (rating);
+
+
+CREATE TABLE RatingState (
+    id INT NOT NULL PRIMARY KEY,
+    lastGameId INT NOT NULL
+);
+
+
+CREATE TABLE GameParticipant (
+    gameId INT NOT NULL REFERENCES Game(id),
+    playerId INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    color VARCHAR(8) NOT NULL,
+    position CHAR(1) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    PRIMARY KEY (gameId, playerId, color, position)
+);
+
+CREATE INDEX index_GameParticipant_player_timestamp ON GameParticipant (playerId, timestamp);
+
+
+CREATE TABLE Metadata (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+INSERT INTO Metadata (name, value) VALUES ('playerVersion', 1);
+
+
+CREATE TABLE TeamSummary (
+    player1Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    player2Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    defenseId INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, defenseId)
+);
+
+CREATE INDEX index_TeamSummary_defenseId ON TeamSummary (defenseId);
+
+
+CREATE TABLE TeamVersusSummary (
+    player1Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    player2Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    opponent1Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    opponent2Id INT NOT NULL REFERENCES Player(id) ON UPDATE CASCADE,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, opponent1Id, opponent2Id)
+);
@@ -0,0 +1,32 @@
+-- Adds the stats summary tables to an existing Foosball database.
+-- Afterwards, populate them from the existing games with "/foosball rebuildStats" (or POST /stats/rebuild).
+USE Foosball;
+
+
+CREATE TABLE IF NOT EXISTS PlayerSummary (
+    playerId INT NOT NULL,
+    rel VARCHAR(16) NOT NULL,
+    rval VARCHAR(16) NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, rval),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE
+);
+
+
+CREATE TABLE IF NOT EXISTS PairSummary (
+    playerId INT NOT NULL,
+    rel VARCHAR(16) NOT NULL,
+    otherId INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (playerId, rel, otherId),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (otherId) REFERENCES Player(id) ON UPDATE CASCADE
+);
@@ -0,0 +1,18 @@
+-- Adds the skill rating tables to an existing Foosball database.
+-- Afterwards, compute ratings for the existing games with "/foosball rebuildStats" (or POST /stats/rebuild).
+USE Foosball;
+
+
+CREATE TABLE IF NOT EXISTS Rating (
+    playerId INT NOT NULL PRIMARY KEY,
+    rating DOUBLE NOT NULL,
+    gamesRated INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_Rating_rating (rating)
+);
+
+
+CREATE TABLE IF NOT EXISTS RatingState (
+    id INT NOT NULL PRIMARY KEY,
+    lastGameId INT NOT NULL
+);
@@ -0,0 +1,5 @@
+-- Indexes Game.timestamp so time-limited stats and recent games are served by range scans.
+USE Foosball;
+
+
+ALTER TABLE Game ADD INDEX index_Game_timestamp (timestamp);
@@ -0,0 +1,27 @@
+-- Adds the GameParticipant table (one row per game, player, color and position) and backfills it from Game.
+-- Position is 'D' (defense), 'O' (offense) or 'S' (a solo player covering both).
+USE Foosball;
+
+
+CREATE TABLE IF NOT EXISTS GameParticipant (
+    gameId INT NOT NULL,
+    playerId INT NOT NULL,
+    color VARCHAR(8) NOT NULL,
+    position CHAR(1) NOT NULL,
+    timestamp DATETIME NOT NULL,
+    PRIMARY KEY (gameId, playerId, color, position),
+    FOREIGN KEY (gameId) REFERENCES Game(id),
+    FOREIGN KEY (playerId) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_GameParticipant_player_timestamp (playerId, timestamp)
+);
+
+
+DELETE FROM GameParticipant;
+
+INSERT INTO GameParticipant (gameId, playerId, color, position, timestamp)
+    SELECT id, redOffense, 'red', 'S', timestamp FROM Game WHERE redOffense = redDefense UNION ALL
+    SELECT id, redDefense, 'red', 'D', timestamp FROM Game WHERE redOffense <> redDefense UNION ALL
+    SELECT id, redOffense, 'red', 'O', timestamp FROM Game WHERE redOffense <> redDefense UNION ALL
+    SELECT id, blackOffense, 'black', 'S', timestamp FROM Game WHERE blackOffense = blackDefense UNION ALL
+    SELECT id, blackDefense, 'black', 'D', timestamp FROM Game WHERE blackOffense <> blackDefense UNION ALL
+    SELECT id, blackOffense, 'black', 'O', timestamp FROM Game WHERE blackOffense <> blackDefense;
@@ -0,0 +1,12 @@
+-- Adds the Metadata table.  playerVersion is bumped whenever a player is added or renamed; together with the latest
+-- Game.id it versions the cached web responses.
+USE Foosball;
+
+
+CREATE TABLE IF NOT EXISTS Metadata (
+    name VARCHAR(64) NOT NULL PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+
+INSERT IGNORE INTO Metadata (name, value) VALUES ('playerVersion', 1);
@@ -0,0 +1,39 @@
+-- Adds the team summary tables.  TeamSummary keeps each two-player team's totals, keyed by the player ids in ascending
+-- order and defenseId (0 for all the team's games, otherwise the player who played defense); TeamVersusSummary keeps a
+-- team's totals against each opposing side (opponent1Id = opponent2Id for one player playing both positions).
+-- Afterwards, fill them from the existing games with "/foosball rebuildStats" (or POST /stats/rebuild).
+USE Foosball;
+
+
+CREATE TABLE IF NOT EXISTS TeamSummary (
+    player1Id INT NOT NULL,
+    player2Id INT NOT NULL,
+    defenseId INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, defenseId),
+    FOREIGN KEY (player1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (player2Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    INDEX index_TeamSummary_defenseId (defenseId)
+);
+
+
+CREATE TABLE IF NOT EXISTS TeamVersusSummary (
+    player1Id INT NOT NULL,
+    player2Id INT NOT NULL,
+    opponent1Id INT NOT NULL,
+    opponent2Id INT NOT NULL,
+    gamesPlayed INT NOT NULL DEFAULT 0,
+    wins INT NOT NULL DEFAULT 0,
+    losses INT NOT NULL DEFAULT 0,
+    ties INT NOT NULL DEFAULT 0,
+    goalDelta INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player1Id, player2Id, opponent1Id, opponent2Id),
+    FOREIGN KEY (player1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (player2Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (opponent1Id) REFERENCES Player(id) ON UPDATE CASCADE,
+    FOREIGN KEY (opponent2Id) REFERENCES Player(id) ON UPDATE CASCADE
+);
@@ -0,0 +1,7 @@
+-- Stores player names (and Game.recordedBy) as utf8mb4, so names in any script can be added.  Indexing the 256
+-- character Player.name in utf8mb4 needs InnoDB's large index prefixes (the default from MySQL 5.7.7 on).
+USE Foosball;
+
+
+ALTER TABLE Player CONVERT TO CHARACTER SET utf8mb4;
+ALTER TABLE Game CONVERT TO CHARACTER SET utf8mb4;
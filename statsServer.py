@@ -7,13 +7,40 @@
 
 import datetime
 import re
-import MySQLdb
 import requests
 import json
+import csv
+import hashlib
+import hmac
 import random
-from collections import defaultdict
+import os
+import signal
+import threading
+import time
+import atexit
+import mmap
+import struct
+import tempfile
+from collections import deque, OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+except ImportError:
+    MySQLdb = None
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 from flask import Flask
-from flask import request, abort
+from flask import request, abort, Response
 from flask.json import jsonify
 import logging
 from logging import Formatter
@@ -25,121 +52,894 @@ app = Flask(__name__)
 
 _g_config = {}
 _g_configFile = "./foosball.cfg"     ## Adjust to environment...
+_g_configCheckInterval = 2.0         ## Seconds between checks of the config file's mtime.
 
+_g_configMtime = None
+_g_configChecked = 0.0
+_g_configReloadRequested = False
+_g_configLock = threading.Lock()
+_g_loggingStarted = False
+_g_insults = []
+_g_insultsMtime = None
 
 
-def _readConfigFile():
+
+## The parsed config (and insult list) is kept in memory and only re-read when foosball.cfg's mtime changes,
+## on SIGUSR2, or via POST /config/reload.  A config file that fails to load keeps the previous config in place.
+def _readConfigFile(force = False):
     global _g_configFile
     global _g_config
+    global _g_configMtime
+    global _g_configChecked
+    global _g_configReloadRequested
+    now = time.time()
+    if (len(_g_config) > 0  and  not force  and  not _g_configReloadRequested  and  now - _g_configChecked < _g_configCheckInterval):
+        return True
+    with _g_configLock:
+        force = force  or  _g_configReloadRequested
+        _g_configReloadRequested = False
+        _g_configChecked = now
+        try:
+            mtime = os.stat(_g_configFile).st_mtime
+            if (force  or  mtime != _g_configMtime):
+                with open(_g_configFile) as inpf:
+                    config = json.load(inpf)
+                if ("logging" not in config  or  "database" not in config  or  "slack" not in config):
+                    raise Exception("missing required section")
+                _g_config = config
+                _g_configMtime = mtime
+        except Exception as e:
+            app.logger.error("Caught exception reading the config file '" + _g_configFile + "':  " + str(e))
+            if (len(_g_config) == 0):
+                abort(500)
+            return False
+        _readInsultFile(force)
+    return True
+
+
+def _readInsultFile(force = False):
+    global _g_config
+    global _g_insults
+    global _g_insultsMtime
+    if ("insultFile" not in _g_config):
+        _g_insults = []
+        return
     try:
-        with open(_g_configFile) as inpf:        
-            _g_config = json.load(inpf)    
+        mtime = os.stat(_g_config["insultFile"]).st_mtime
+        if (force  or  mtime != _g_insultsMtime):
+            lines = []
+            for line in open(_g_config["insultFile"]):
+                lines.append(line)
+            _g_insults = lines
+            _g_insultsMtime = mtime
     except Exception as e:
-        app.logger.error("Caught exception reading the config file '" + _g_configFile + "':  " + str(e))
-        abort(500) 
-    if ("logging" not in _g_config  or  "database" not in _g_config  or  "slack" not in _g_config):
-        app.logger.error("Config file '" + _g_configFile + "' missing required section.")
-        abort(500)
+        app.logger.error("Caught exception reading the insult file '" + str(_g_config["insultFile"]) + "':  " + str(e))
+
+
+def _requestConfigReload(signum, frame):
+    global _g_configReloadRequested
+    _g_configReloadRequested = True
+
+## SIGUSR2 rather than SIGHUP, which uWSGI (and most process managers) already use for a graceful reload of the workers.
+try:
+    signal.signal(signal.SIGUSR2, _requestConfigReload)
+except (AttributeError, ValueError):
+    pass        ## No SIGUSR2 on this platform, or not imported on the main thread.
 
 
 def _enableLogging():
     global _g_config
-    if (("started" in _g_config["logging"]  and  _g_config["logging"]["started"])  or  app.debug):
+    global _g_loggingStarted
+    if (_g_loggingStarted  or  app.debug):
         return
     handler = FileHandler(_g_config["logging"]["logfile"])
     handler.setFormatter(Formatter('%(asctime)s %(levelname)s line=%(lineno)d - %(message)s'))
     handler.setLevel(_g_config["logging"]["level"])
     app.logger.addHandler(handler)
-    _g_config["logging"]["started"] = True
+    _g_loggingStarted = True
 
 
 def _startup():
     _readConfigFile()
     _enableLogging()
+    _catchUpRatings()
+
+
+#############
+## Metrics ##
+#############
+
+## Latency histograms and counters, exposed on /metrics in the Prometheus text format (per worker process:  scrape each
+## worker, or aggregate by instance).  Each request also carries a trace of where its time went (connection checkout,
+## database queries, the Slack command it ran), which is logged for requests slower than slowRequestSeconds.
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_METRIC_HELP = {
+    "foosball_request_seconds" : ("histogram", "Web request latency by route."),
+    "foosball_request_db_queries_total" : ("counter", "Database queries made by web requests, by route."),
+    "foosball_request_db_seconds_total" : ("counter", "Time web requests spent in database queries, by route."),
+    "foosball_slack_command_seconds" : ("histogram", "Slack command latency by subcommand."),
+    "foosball_slack_command_db_queries_total" : ("counter", "Database queries made by Slack commands, by subcommand."),
+    "foosball_slack_command_db_seconds_total" : ("counter", "Time Slack commands spent in database queries, by subcommand."),
+    "foosball_db_query_seconds" : ("histogram", "Database query (execute / executemany) latency."),
+    "foosball_db_checkout_seconds" : ("histogram", "Time to get a connection from the pool in _connectDB."),
+    "foosball_db_connect_seconds" : ("histogram", "Time to open a new database connection."),
+    "foosball_slack_post_seconds" : ("histogram", "Latency of chat.postMessage calls."),
+    "foosball_slack_post_failures_total" : ("counter", "Failed chat.postMessage calls, by reason."),
+    "foosball_slow_requests_total" : ("counter", "Requests and Slack commands slower than slowRequestSeconds."),
+}
+
+
+def _escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labelString(labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if (len(pairs) == 0):
+        return ""
+    return "{" + ",".join(name + "=\"" + _escapeLabel(value) + "\"" for (name, value) in pairs) + "}"
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}        ## (name, labels) -> cumulative bucket counts, then count and sum
+        self.counters = {}          ## (name, labels) -> value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if (histogram is None):
+                histogram = self.histograms[key] = [ 0 ] * len(_LATENCY_BUCKETS) + [ 0, 0.0 ]
+            for i in range(len(_LATENCY_BUCKETS)):
+                if (seconds <= _LATENCY_BUCKETS[i]):
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def increment(self, name, amount = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        described = set()
+        for ((name, labels), histogram) in histograms:
+            if (name not in described):
+                described.add(name)
+                lines.append("# HELP " + name + " " + _METRIC_HELP[name][1])
+                lines.append("# TYPE " + name + " histogram")
+            for i in range(len(_LATENCY_BUCKETS)):
+                lines.append(name + "_bucket" + _labelString(labels, [ ("le", repr(_LATENCY_BUCKETS[i])) ]) + " " + str(histogram[i]))
+            lines.append(name + "_bucket" + _labelString(labels, [ ("le", "+Inf") ]) + " " + str(histogram[-2]))
+            lines.append(name + "_count" + _labelString(labels) + " " + str(histogram[-2]))
+            lines.append(name + "_sum" + _labelString(labels) + " " + repr(histogram[-1]))
+        for ((name, labels), value) in counters:
+            if (name not in described):
+                described.add(name)
+                lines.append("# HELP " + name + " " + _METRIC_HELP[name][1])
+                lines.append("# TYPE " + name + " counter")
+            lines.append(name + _labelString(labels) + " " + repr(value))
+        return lines
 
 
-def _connectDB():
+_g_metrics = Metrics()
+_g_trace = threading.local()
+
+
+class _Trace(object):
+    def __init__(self):
+        self.start = time.time()
+        self.stages = OrderedDict()     ## stage -> seconds
+        self.queries = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+def _currentTrace():
+    return getattr(_g_trace, "trace", None)
+
+
+def _beginTrace():
+    _g_trace.trace = _Trace()
+    return _g_trace.trace
+
+
+def _endTrace():
+    trace = _currentTrace()
+    _g_trace.trace = None
+    return trace
+
+
+## Records seconds in the named histogram and, if this thread is tracing a request, under stage in its trace.
+def _recordTiming(metric, stage, seconds, **labels):
+    _g_metrics.observe(metric, seconds, **labels)
+    trace = _currentTrace()
+    if (trace is not None):
+        trace.add(stage, seconds)
+
+
+def _logIfSlow(what, seconds, trace):
+    if (seconds < float(_g_config.get("slowRequestSeconds", 1.0))):
+        return
+    _g_metrics.increment("foosball_slow_requests_total")
+    breakdown = []
+    accounted = 0.0
+    for (stage, stageSeconds) in trace.stages.items():
+        breakdown.append("%s %.3fs" % (stage, stageSeconds))
+        if (not stage.startswith("command")):
+            accounted += stageSeconds
+    breakdown.append("%d queries" % trace.queries)
+    breakdown.append("other %.3fs" % max(0.0, seconds - accounted))
+    app.logger.warning("Slow request %s:  %.3fs (%s)" % (what, seconds, ", ".join(breakdown)))
+
+
+## Wraps a driver cursor to count and time its queries.
+class _InstrumentedCursor(object):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _timed(self, method, query, args):
+        start = time.time()
+        try:
+            return method(query, args) if (args is not None) else method(query)
+        finally:
+            _recordTiming("foosball_db_query_seconds", "db", time.time() - start)
+            trace = _currentTrace()
+            if (trace is not None):
+                trace.queries += 1
+
+    def execute(self, query, args = None):
+        return self._timed(self.cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self.cursor.executemany, query, args)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+#############
+## Storage ##
+#############
+
+## Data access goes through a storage backend, picked with "backend" in the database section of foosball.cfg:  "mysql"
+## (the default) or "sqlite", an embedded database file ("sqliteFile") for installations that would rather not run a
+## MySQL server.  A backend opens the pool's connections and owns the SQL that differs between the two -- upserts, row
+## locks, unbuffered cursors and inserting games -- and the queries of PlayerStats.tally, the player helpers and the
+## game, recent and trash commands.  Everything else is written in SQL both accept, with %s placeholders.
+##
+## Values are always bound, never pasted into the SQL, and the hot statements below have fixed texts, so each is parsed
+## once per connection:  sqlite3 keeps every connection's compiled statements keyed by their text.  MySQLdb has no
+## server-side prepared statements (it escapes the values into the text client-side), so for MySQL the fixed texts
+## only keep the server's work per statement the same.
+
+_PLAYER_BY_NAME = "SELECT id, name FROM Player WHERE name = %s"
+_PLAYER_BY_ID = "SELECT name FROM Player WHERE id = %s"
+_GAME_INSERT = "INSERT INTO Game (timestamp, recordedBy, redScore, blackScore, redDefense, redOffense, blackDefense, blackOffense) " \
+               "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+_PLAYER_GAMES = "SELECT G.redScore, G.blackScore, G.redOffense, G.redDefense, G.blackOffense, G.blackDefense, GP.color " \
+                "FROM GameParticipant AS GP JOIN Game AS G ON G.id = GP.gameId WHERE GP.playerId = %s"
+_PLAYER_GAMES_WITH = " AND EXISTS (SELECT 1 FROM GameParticipant AS GP2 WHERE GP2.gameId = GP.gameId AND GP2.playerId = %s)"
+_SQLITE_STATEMENT_CACHE = 256       ## Compiled statements kept per SQLite connection.
+
+
+## _GAME_INSERT's values for a game row as for _tallyGames.
+def _gameInsertArgs(timestamp, user, row):
+    return (timestamp, user, int(row[0]), int(row[1]), int(row[3]), int(row[2]), int(row[5]), int(row[4]))
+
+## WAL lets readers carry on while a game is written; NORMAL sync is durable across crashes of the server (a power cut
+## can lose the last commits, not corrupt the file).
+_SQLITE_PRAGMAS = ("PRAGMA journal_mode = WAL",
+                   "PRAGMA synchronous = NORMAL",
+                   "PRAGMA foreign_keys = ON",
+                   "PRAGMA temp_store = MEMORY",
+                   "PRAGMA cache_size = -16384",         ## KiB
+                   "PRAGMA mmap_size = 268435456")
+
+
+class _Storage(object):
+    def __init__(self, dbConfig):
+        self.dbConfig = dbConfig
+
+    ## Player helpers.
+
+    def findPlayer(self, cursor, playerName):       ## (id, name as stored), or None
+        cursor.execute(_PLAYER_BY_NAME, (playerName,))
+        return cursor.fetchone()
+
+    def findPlayers(self, cursor, playerNames):     ## [ (id, name as stored) ]
+        cursor.execute("SELECT id, name FROM Player WHERE name IN (" + ", ".join([ "%s" ] * len(playerNames)) + ")", tuple(playerNames))
+        return cursor.fetchall()
+
+    def playerName(self, cursor, playerId):
+        cursor.execute(_PLAYER_BY_ID, (int(playerId),))
+        row = cursor.fetchone()
+        return row[0] if (row is not None) else None
+
+    def allPlayers(self, cursor):                   ## [ (id, name) ]
+        cursor.execute("SELECT id, name FROM Player")
+        return cursor.fetchall()
+
+    def addPlayer(self, cursor, playerName):        ## Returns the new id; caller commits.
+        cursor.execute("INSERT INTO Player (name) VALUES (%s)", (playerName,))
+        return cursor.lastrowid
+
+    def renamePlayer(self, cursor, playerId, playerName):
+        cursor.execute("UPDATE Player SET name = %s WHERE id = %s", (playerName, int(playerId)))
+
+    ## Games.
+
+    def insertGame(self, cursor, timestamp, user, row):     ## row as for _tallyGames; returns the new id
+        cursor.execute(_GAME_INSERT, _gameInsertArgs(timestamp, user, row))
+        return cursor.lastrowid
+
+    ## games:  [ (timestamp, row) ]; returns [ (id, timestamp, row) ].  One statement per game, each id from its own
+    ## lastrowid:  the ids of a multi-row INSERT needn't be consecutive (MySQL 8's innodb_autoinc_lock_mode 2 lets
+    ## concurrent inserts interleave), and executemany leaves no lastrowid behind on SQLite.
+    def insertGames(self, cursor, games, user):
+        return [ (int(self.insertGame(cursor, timestamp, user, row)), timestamp, row) for (timestamp, row) in games ]
+
+    ## One player's games, optionally within timeRange or only those otherId also played in, as
+    ## (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense, the player's color); red games first.
+    def playerGames(self, cursor, playerId, timeRange = None, otherId = None):
+        query = _PLAYER_GAMES
+        args = [ int(playerId) ]
+        if (timeRange is not None):
+            (condition, rangeArgs) = _timeRangeCondition(timeRange, "GP.timestamp")
+            query += " AND " + condition
+            args.extend(rangeArgs)
+        if (otherId is not None):
+            query += _PLAYER_GAMES_WITH
+            args.append(int(otherId))
+        cursor.execute(query + " ORDER BY GP.color DESC", args)          ## red, then black
+        return cursor.fetchall()
+
+    ## Games in timeRange, newest first, as (id, timestamp, recordedBy, redScore, blackScore, redDefense name,
+    ## redOffense name, blackDefense name, blackOffense name).
+    def recentGames(self, cursor, timeRange):
+        query = "SELECT G.id, G.timestamp, G.recordedBy, G.redScore, G.blackScore, RD.name, RO.name, BD.name, BO.name FROM Game AS G "
+        query += "JOIN Player AS RD ON RD.id = G.redDefense JOIN Player AS RO ON RO.id = G.redOffense "
+        query += "JOIN Player AS BD ON BD.id = G.blackDefense JOIN Player AS BO ON BO.id = G.blackOffense "
+        (condition, args) = _timeRangeCondition(timeRange, "G.timestamp")
+        cursor.execute(query + "WHERE " + condition + " ORDER BY G.timestamp DESC", args)
+        return cursor.fetchall()
+
+    ## The newest game in timeRange as a Game row (id, timestamp, recordedBy, redScore, blackScore, redDefense,
+    ## redOffense, blackDefense, blackOffense), or None.
+    def lastGame(self, cursor, timeRange):
+        (condition, args) = _timeRangeCondition(timeRange, "timestamp")
+        cursor.execute("SELECT id, timestamp, recordedBy, redScore, blackScore, redDefense, redOffense, blackDefense, blackOffense FROM Game " \
+                       "WHERE " + condition + " ORDER BY timestamp DESC LIMIT 1", args)
+        return cursor.fetchone()
+
+
+class MySQLStorage(_Storage):
+    name = "mysql"
+    schemaFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "foosball.sql")
+
+    def connect(self):
+        if (MySQLdb is None):
+            raise Exception("database backend is 'mysql' but MySQLdb is not installed.")
+        if ("optionalSocket" in self.dbConfig):
+            return MySQLdb.connect(self.dbConfig["server"], \
+                                   self.dbConfig["user"], \
+                                   self.dbConfig["password"], \
+                                   self.dbConfig["name"], \
+                                   unix_socket=self.dbConfig["optionalSocket"], \
+                                   charset="utf8mb4", use_unicode=True)
+        else:
+            return MySQLdb.connect(self.dbConfig["server"], \
+                                   self.dbConfig["user"], \
+                                   self.dbConfig["password"], \
+                                   self.dbConfig["name"], \
+                                   charset="utf8mb4", use_unicode=True)
+
+    def streamingCursor(self, db):                  ## Rows are fetched as they're read rather than all up front.
+        return db.cursor(MySQLdb.cursors.SSCursor)
+
+    def selectForUpdate(self, cursor, query, args = None):      ## Runs a SELECT that locks what it reads until commit.
+        cursor.execute(query + " FOR UPDATE", args)
+
+    ## INSERT of keyColumns + columns that, where the key exists, adds columns to the row's (add), keeps the greater of
+    ## the two (greatest), or replaces them.
+    def upsert(self, table, keyColumns, columns, add = False, greatest = False):
+        def update(c):
+            if (add):
+                return c + " = " + c + " + VALUES(" + c + ")"
+            elif (greatest):
+                return c + " = GREATEST(" + c + ", VALUES(" + c + "))"
+            return c + " = VALUES(" + c + ")"
+        return "INSERT INTO " + table + " (" + ", ".join(keyColumns + columns) + ") VALUES (" + ", ".join([ "%s" ] * len(keyColumns + columns)) + ")" \
+               " ON DUPLICATE KEY UPDATE " + ", ".join(update(c) for c in columns)
+
+
+def _sqliteDatetime(value):
+    return datetime.datetime.strptime(value.decode("ascii")[:19], "%Y-%m-%d %H:%M:%S")
+
+if (sqlite3 is not None):
+    sqlite3.register_converter("DATETIME", _sqliteDatetime)        ## Timestamps come back as datetimes, as from MySQLdb.
+
+
+_SQLITE_WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+## Takes MySQLdb's %s placeholders, and starts a transaction before the first write (see _SQLiteConnection).
+class _SQLiteCursor(object):
+    def __init__(self, db):
+        self.db = db
+        self.cursor = db.conn.cursor()
+
+    def begin(self):
+        self.db.begin()
+
+    def execute(self, query, args = None):
+        if (query.lstrip()[:7].upper().startswith(_SQLITE_WRITES)):
+            self.db.begin()
+        return self.cursor.execute(query.replace("%s", "?"), tuple(args) if (args is not None) else ())
+
+    def executemany(self, query, args):
+        self.db.begin()
+        return self.cursor.executemany(query.replace("%s", "?"), [ tuple(a) for a in args ])
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+## The sqlite3 module is left in autocommit mode (isolation_level None) and transactions are begun here instead:  its
+## own implicit BEGIN is DEFERRED, and Python 2's module doesn't say whether one is open (no in_transaction).  Every
+## transaction is BEGIN IMMEDIATE, so it holds the write lock from the start and two writers can't deadlock upgrading.
+class _SQLiteConnection(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.inTransaction = False
+
+    def cursor(self):
+        return _SQLiteCursor(self)
+
+    def begin(self):
+        if (not self.inTransaction):
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.inTransaction = True
+
+    def commit(self):
+        self.inTransaction = False
+        self.conn.commit()
+
+    def rollback(self):
+        self.inTransaction = False
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def ping(self):
+        pass                        ## Nothing in between to go away.
+
+
+class SQLiteStorage(_Storage):
+    name = "sqlite"
+    schemaFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "foosball_sqlite.sql")
+
+    ## A new database file gets the schema on first connect.
+    def connect(self):
+        if (sqlite3 is None):
+            raise Exception("database backend is 'sqlite' but the sqlite3 module is not available.")
+        conn = sqlite3.connect(self.dbConfig.get("sqliteFile", "./foosball.db"), \
+                               timeout=float(self.dbConfig.get("sqliteBusyTimeout", 5.0)), \
+                               detect_types=sqlite3.PARSE_DECLTYPES, \
+                               cached_statements=_SQLITE_STATEMENT_CACHE, \
+                               isolation_level=None, \
+                               check_same_thread=False)        ## The pool hands connections from thread to thread.
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        if (conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Player'").fetchone() is None):
+            with open(self.schemaFile) as f:
+                conn.executescript(f.read())
+        return _SQLiteConnection(conn)
+
+    def streamingCursor(self, db):                  ## SQLite cursors already step through rows as they're fetched.
+        return db.cursor()
+
+    ## SQLite locks the whole database rather than rows:  beginning the transaction (IMMEDIATE) takes the write lock
+    ## before the read, so no other writer can change what was read before this commits.
+    def selectForUpdate(self, cursor, query, args = None):
+        cursor.begin()
+        cursor.execute(query, args)
+
+    def upsert(self, table, keyColumns, columns, add = False, greatest = False):
+        def update(c):
+            if (add):
+                return c + " = " + c + " + excluded." + c
+            elif (greatest):
+                return c + " = MAX(" + c + ", excluded." + c + ")"
+            return c + " = excluded." + c
+        return "INSERT INTO " + table + " (" + ", ".join(keyColumns + columns) + ") VALUES (" + ", ".join([ "%s" ] * len(keyColumns + columns)) + ")" \
+               " ON CONFLICT (" + ", ".join(keyColumns) + ") DO UPDATE SET " + ", ".join(update(c) for c in columns)
+
+
+_STORAGE_BACKENDS = { "mysql" : MySQLStorage, "sqlite" : SQLiteStorage }
+
+
+def _openStorage(dbConfig):
+    backend = dbConfig.get("backend", "mysql")
+    if (backend not in _STORAGE_BACKENDS):
+        raise Exception("unknown database backend '" + str(backend) + "'; use 'mysql' or 'sqlite'.")
+    return _STORAGE_BACKENDS[backend](dbConfig)
+
+
+class _PooledConnection(object):
+    def __init__(self, pool, conn, created):
+        self.pool = pool
+        self.conn = conn
+        self.created = created
+        self.lastUsed = created
+        self.closed = False
+
+    def cursor(self, *args):
+        return _InstrumentedCursor(self.conn.cursor(*args))
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):                ## Returns the connection to the pool rather than closing it.
+        if (not self.closed):
+            self.closed = True
+            self.pool.checkin(self)
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, size = 5, waitTimeout = 5.0, idleTimeout = 300.0, maxLifetime = 3600.0, pingInterval = 10.0):
+        self.connect = connect
+        self.size = size
+        self.waitTimeout = waitTimeout
+        self.idleTimeout = idleTimeout
+        self.maxLifetime = maxLifetime
+        self.pingInterval = pingInterval
+        self.config = None
+        self.storage = None
+        self.ratingsCaughtUp = False
+        self.closed = False
+        self.idle = []
+        self.numOpen = 0
+        self.cond = threading.Condition()
+        self.stats = { "checkouts" : 0, "waits" : 0, "waitTimeouts" : 0, "totalWaitSeconds" : 0.0, "maxWaitSeconds" : 0.0, \
+                       "connectionsOpened" : 0, "connectionsClosed" : 0, "reconnects" : 0 }
+
+    def _expired(self, pc, now):
+        return (now - pc.created > self.maxLifetime  or  now - pc.lastUsed > self.idleTimeout)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.numOpen -= 1
+            self.stats["connectionsClosed"] += 1
+            self.cond.notify()
+
+    def _open(self):
+        start = time.time()
+        try:
+            conn = self.connect()
+            _recordTiming("foosball_db_connect_seconds", "connect", time.time() - start)
+        except Exception:
+            with self.cond:
+                self.numOpen -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.stats["connectionsOpened"] += 1
+        return conn
+
+    def checkout(self):
+        start = time.time()
+        waited = False
+        pc = None
+        create = False
+        with self.cond:
+            while (pc is None  and  not create):
+                now = time.time()
+                while (len(self.idle) > 0):
+                    candidate = self.idle.pop()
+                    if (self._expired(candidate, now)):
+                        self.numOpen -= 1
+                        self.stats["connectionsClosed"] += 1
+                        try:
+                            candidate.conn.close()
+                        except Exception:
+                            pass
+                    else:
+                        pc = candidate
+                        break
+                if (pc is None):
+                    if (self.numOpen < self.size):
+                        self.numOpen += 1
+                        create = True
+                    else:
+                        remaining = self.waitTimeout - (now - start)
+                        if (remaining <= 0):
+                            self.stats["waitTimeouts"] += 1
+                            raise Exception("Timed out waiting for a database connection.")
+                        waited = True
+                        self.cond.wait(remaining)
+            waitSeconds = time.time() - start
+            self.stats["checkouts"] += 1
+            if (waited):
+                self.stats["waits"] += 1
+                self.stats["totalWaitSeconds"] += waitSeconds
+                self.stats["maxWaitSeconds"] = max(self.stats["maxWaitSeconds"], waitSeconds)
+        now = time.time()
+        if (create):
+            return _PooledConnection(self, self._open(), now)
+        if (now - pc.lastUsed > self.pingInterval):
+            try:
+                pc.conn.ping()
+            except Exception:
+                try:
+                    pc.conn.close()
+                except Exception:
+                    pass
+                with self.cond:
+                    self.stats["reconnects"] += 1
+                    self.stats["connectionsClosed"] += 1
+                return _PooledConnection(self, self._open(), now)      ## Keeps the slot pc held.
+        return _PooledConnection(self, pc.conn, pc.created)
+
+    def checkin(self, pc):
+        try:
+            pc.conn.rollback()      ## Don't hand the next request an open transaction (or its stale snapshot).
+        except Exception:
+            self._discard(pc.conn)
+            return
+        now = time.time()
+        if (now - pc.created > self.maxLifetime):
+            self._discard(pc.conn)
+            return
+        pc.lastUsed = now
+        with self.cond:
+            if (not self.closed):
+                self.idle.append(pc)
+                self.cond.notify()
+                return
+        self._discard(pc.conn)     ## The pool was replaced while this was checked out.
+
+    ## Closes the idle connections now, and the checked-out ones as they come back.
+    def close(self):
+        with self.cond:
+            self.closed = True
+        self.closeIdle()
+
+    def closeIdle(self):
+        with self.cond:
+            idle = self.idle
+            self.idle = []
+        for pc in idle:
+            self._discard(pc.conn)
+
+    def statistics(self):
+        with self.cond:
+            result = dict(self.stats)
+            result["size"] = self.size
+            result["open"] = self.numOpen
+            result["idle"] = len(self.idle)
+            result["inUse"] = self.numOpen - len(self.idle)
+        return result
+
+
+_g_pool = None
+_g_poolLock = threading.Lock()
+
+
+def _connectionPool():
     global _g_config
-    if ("optionalSocket" in _g_config["database"]):
-        return MySQLdb.connect(_g_config["database"]["server"], \
-                               _g_config["database"]["user"], \
-                               _g_config["database"]["password"], \
-                               _g_config["database"]["name"], \
-                               unix_socket=_g_config["database"]["optionalSocket"])
-    else:
-        return MySQLdb.connect(_g_config["database"]["server"], \
-                               _g_config["database"]["user"], \
-                               _g_config["database"]["password"], \
-                               _g_config["database"]["name"])
+    global _g_pool
+    with _g_poolLock:
+        dbConfig = _g_config["database"]
+        if (_g_pool is not None  and  _g_pool.config != dbConfig):
+            _g_pool.close()                 ## The database section changed on a config reload.
+            _g_pool = None
+        if (_g_pool is None):
+            storage = _openStorage(dbConfig)
+            _g_pool = ConnectionPool(storage.connect, \
+                                     int(dbConfig.get("poolSize", 5)), \
+                                     float(dbConfig.get("poolWaitTimeout", 5.0)), \
+                                     float(dbConfig.get("poolIdleTimeout", 300.0)), \
+                                     float(dbConfig.get("poolMaxLifetime", 3600.0)), \
+                                     float(dbConfig.get("poolPingInterval", 10.0)))
+            _g_pool.config = dbConfig
+            _g_pool.storage = storage
+        return _g_pool
+
+
+def _storage():
+    return _connectionPool().storage
+
+
+def _connectDB():
+    start = time.time()
+    db = _connectionPool().checkout()
+    _recordTiming("foosball_db_checkout_seconds", "checkout", time.time() - start)
+    return db
+
 
+## PlayerStats keeps its tallies in flat integer arrays:  one block of _NUM_FIELDS counters for each of the fixed
+## categories (overall, solo, as red, as black), plus one block per partner / opponent.  Partners and solo opponents are
+## keyed by player id, two-player opposing teams by an (offense, defense) tuple.
+_FIELD_PLAYED = 0
+_FIELD_WIN = 1
+_FIELD_LOSS = 2
+_FIELD_TIE = 3
+_FIELD_GOALS = 4
+_NUM_FIELDS = 5
 
-def _multiDict(n, type):
-    if (n <= 1):
-        return type()
-    return defaultdict(lambda:_multiDict(n - 1, type))
+_CAT_OVERALL = 0
+_CAT_SOLO = 1
+_CAT_RED = 2
+_CAT_BLACK = 3
+_CATEGORIES = (("", ""), ("with", ""), ("as", "red"), ("as", "black"))
+_CATEGORY_ORDER = (_CAT_OVERALL, _CAT_RED, _CAT_BLACK, _CAT_SOLO)     ## The order /stats lists them in.
 
-def _incrElement(dictref, key, amount = 1):
-    if (key not in dictref):
-        dictref[key] = 0
-    dictref[key] = dictref[key] + amount
+
+def _pairKey(rval):
+    if ("+" in rval):
+        (opp1, opp2) = rval.split("+", 1)
+        return (int(opp1), int(opp2))
+    return int(rval)
 
 
 class PlayerStats(object):
-    def __init__(self, name):
+    __slots__ = ("name", "playerId", "counts", "partners", "opponents", "catMask")
+
+    def __init__(self, name, playerId = -1):
         self.name = name
+        self.playerId = playerId
         self.reset()
 
     def reset(self):
-        self.gamesPlayed = _multiDict(3, int)              # {rel, rval}
-        self.gameResults = _multiDict(4, int)              # {result, rel, rval}
-        self.goalDelta = _multiDict(3, int)                # {rel, rval}
+        self.counts = [0] * (len(_CATEGORIES) * _NUM_FIELDS)
+        self.partners = {}                  # {partnerId : counters}
+        self.opponents = {}                 # {opponentId or (offenseId, defenseId) : counters}
+        ## Which categories have been looked at, so toDictionary() lists exactly the ones the player has.
+        self.catMask = 0
+
+    def _touchCategory(self, cat):
+        self.catMask |= (1 << cat)
+
+    ## Returns (counters, offset) for a (rel, rval) category, as used by the output methods.
+    def _counters(self, rel, rval, create = False):
+        if (rel == ""):
+            cat = _CAT_OVERALL
+        elif (rel == "as"):
+            cat = _CAT_RED if (rval == "red") else _CAT_BLACK
+        elif (rel == "with"  and  rval == ""):
+            cat = _CAT_SOLO
+        else:
+            pairs = self.partners if (rel == "with") else self.opponents
+            key = _pairKey(rval)
+            if (key not in pairs):
+                if (not create):
+                    return ([0] * _NUM_FIELDS, 0)
+                pairs[key] = [0] * _NUM_FIELDS
+            return (pairs[key], 0)
+        self._touchCategory(cat)
+        return (self.counts, cat * _NUM_FIELDS)
 
     def sortKey(self, rel, rval):
-        return (float(self.gameResults["win"][rel][rval]) / self.gamesPlayed[rel][rval]) if (self.gamesPlayed[rel][rval] > 0) else 0.0
+        (counters, offset) = self._counters(rel, rval)
+        return (float(counters[offset + _FIELD_WIN]) / counters[offset]) if (counters[offset] > 0) else 0.0
 
-    def tally(self, colorAs, colorAgainst, db):
-        query = "SELECT G." + colorAs + "Score, G." + colorAgainst + "Score, G." + colorAs + "Offense, G." + colorAs + "Defense, G." + colorAgainst + "Offense, G." + colorAgainst + "Defense, P.id "
-        query += "FROM Game AS G, Player AS P WHERE P.name = '" + self.name + "' AND (P.id = G." + colorAs + "Offense  OR  P.id = G." + colorAs + "Defense)"
+    ## Tallies this player's games (optionally within timeRange, or only those otherId also played in) using the
+    ## GameParticipant (playerId, timestamp) index.
+    def tally(self, db, timeRange = None, otherId = None):
         cursor = db.cursor()
         try:
-            cursor.execute(query)
-            for row in cursor.fetchall():
-                goalDelta = row[0] - row[1]
-                if (row[0] > row[1]):
-                    result = "win"
-                elif (row[0] < row[1]):
-                    result = "loss"
+            for row in _storage().playerGames(cursor, self.playerId, timeRange, otherId):
+                if (row[6] == "red"):
+                    self.tallyGame("red", (row[0], row[1], row[2], row[3], row[4], row[5], self.playerId))
                 else:
-                    result = "tie"
-                _incrElement(self.gamesPlayed[""], "")
-                _incrElement(self.gameResults[result][""], "")
-                _incrElement(self.goalDelta[""], "", goalDelta)
-                _incrElement(self.gamesPlayed["as"], colorAs)
-                _incrElement(self.gameResults[result]["as"], colorAs)
-                _incrElement(self.goalDelta["as"], colorAs, goalDelta)
-                if (row[2] == row[3]):
-                    _incrElement(self.gamesPlayed["with"], "")
-                    _incrElement(self.gameResults[result]["with"], "")
-                    _incrElement(self.goalDelta["with"], "", goalDelta)
-                else:
-                    partner = str(row[2]) if (row[3] == row[6]) else str(row[3])
-                    _incrElement(self.gamesPlayed["with"], partner)
-                    _incrElement(self.gameResults[result]["with"], partner)
-                    _incrElement(self.goalDelta["with"], partner, goalDelta)
-                if (row[4] == row[5]):
-                    opponent = str(row[2]) if (row[4] == row[6]) else str(row[4])
-                    _incrElement(self.gamesPlayed["against"], opponent)
-                    _incrElement(self.gameResults[result]["against"], opponent)
-                    _incrElement(self.goalDelta["against"], opponent, goalDelta)
-                else:
-                    opp1 = str(row[1]) if (row[4] == row[6]  or  row[5] == row[6]) else str(row[4])
-                    opp2 = str(row[2]) if (row[4] == row[6]  or  row[5] == row[6]) else str(row[5])
-                    opponent = opp1 + "+" + opp2
-                    _incrElement(self.gamesPlayed["against"], opponent)
-                    _incrElement(self.gameResults[result]["against"], opponent)
-                    _incrElement(self.goalDelta["against"], opponent, goalDelta)
+                    self.tallyGame("black", (row[1], row[0], row[4], row[5], row[2], row[3], self.playerId))
         except Exception as e:
-            app.logger.error("Caught exception tallying player stats for '" + self.name + "' as '" + colorAs + "' against '" + colorAgainst + "':  " + str(e))
+            app.logger.error("Caught exception tallying player stats for '" + self.name + "':  " + str(e))
+            return False
+        return True
+
+    ## row is (asScore, againstScore, asOffense, asDefense, againstOffense, againstDefense, playerId)
+    def tallyGame(self, colorAs, row):
+        goalDelta = row[0] - row[1]
+        if (row[0] > row[1]):
+            result = _FIELD_WIN
+        elif (row[0] < row[1]):
+            result = _FIELD_LOSS
+        else:
+            result = _FIELD_TIE
+        asCat = _CAT_RED if (colorAs == "red") else _CAT_BLACK
+        self._touchCategory(_CAT_OVERALL)
+        self._touchCategory(asCat)
+        counts = self.counts
+        for offset in (_CAT_OVERALL * _NUM_FIELDS, asCat * _NUM_FIELDS):
+            counts[offset] += 1
+            counts[offset + result] += 1
+            counts[offset + _FIELD_GOALS] += goalDelta
+        if (row[2] == row[3]):
+            self._touchCategory(_CAT_SOLO)
+            counters = counts
+            offset = _CAT_SOLO * _NUM_FIELDS
+            counters[offset] += 1
+            counters[offset + result] += 1
+            counters[offset + _FIELD_GOALS] += goalDelta
+        else:
+            partner = int(row[2]) if (row[3] == row[6]) else int(row[3])
+            counters = self.partners.get(partner)
+            if (counters is None):
+                counters = self.partners[partner] = [0] * _NUM_FIELDS
+            counters[_FIELD_PLAYED] += 1
+            counters[result] += 1
+            counters[_FIELD_GOALS] += goalDelta
+        if (row[4] == row[5]):
+            opponent = int(row[2]) if (row[4] == row[6]) else int(row[4])
+        elif (row[4] == row[6]  or  row[5] == row[6]):
+            opponent = (int(row[1]), int(row[2]))
+        else:
+            opponent = (int(row[4]), int(row[5]))
+        counters = self.opponents.get(opponent)
+        if (counters is None):
+            counters = self.opponents[opponent] = [0] * _NUM_FIELDS
+        counters[_FIELD_PLAYED] += 1
+        counters[result] += 1
+        counters[_FIELD_GOALS] += goalDelta
+
+    def addTotals(self, rel, rval, gamesPlayed, wins, losses, ties, goalDelta):
+        (counters, offset) = self._counters(rel, rval, True)
+        counters[offset + _FIELD_PLAYED] += int(gamesPlayed)
+        counters[offset + _FIELD_WIN] += int(wins)
+        counters[offset + _FIELD_LOSS] += int(losses)
+        counters[offset + _FIELD_TIE] += int(ties)
+        counters[offset + _FIELD_GOALS] += int(goalDelta)
+
+    ## Adds totals for partners (rel "with") or opponents (rel "against"), keyed as tallyGame keys them.
+    def addPairTotals(self, rel, keys, totals):
+        pairs = self.partners if (rel == "with") else self.opponents
+        for (key, keyTotals) in zip(keys, totals):
+            counters = pairs.get(key)
+            if (counters is None):
+                pairs[key] = list(keyTotals)
+            else:
+                for field in range(_NUM_FIELDS):
+                    counters[field] += keyTotals[field]
+
+    ## Rows for the PlayerSummary (overall/solo/as color) and PairSummary (with/against one other player) tables.
+    ## Tallies against a two-player team are not summarized.
+    def summaryRows(self):
+        categoryRows = []
+        pairRows = []
+        for cat in range(len(_CATEGORIES)):
+            if (self.catMask & (1 << cat)):
+                offset = cat * _NUM_FIELDS
+                categoryRows.append((self.playerId, _CATEGORIES[cat][0], _CATEGORIES[cat][1]) + tuple(self.counts[offset:offset + _NUM_FIELDS]))
+        for (rel, pairs) in (("with", self.partners), ("against", self.opponents)):
+            for (key, counters) in pairs.items():
+                if (not isinstance(key, tuple)):
+                    pairRows.append((self.playerId, rel, key) + tuple(counters))
+        return (categoryRows, pairRows)
 
     @staticmethod
     def categoryString(rel, rval):
@@ -153,21 +953,20 @@ class PlayerStats(object):
             return rel
 
     def typeToDictionary(self, rel, rval):
+        (counters, offset) = self._counters(rel, rval)
         return { "category" : PlayerStats.categoryString(rel, rval), \
                  "categoryStats" : { \
-                     "gamesPlayed" : self.gamesPlayed[rel][rval], \
-                     "wins" : self.gameResults["win"][rel][rval], \
-                     "losses" : self.gameResults["loss"][rel][rval], \
-                     "ties" : self.gameResults["tie"][rel][rval], \
-                     "goalDifferential" : self.goalDelta[rel][rval] } }
+                     "gamesPlayed" : counters[offset + _FIELD_PLAYED], \
+                     "wins" : counters[offset + _FIELD_WIN], \
+                     "losses" : counters[offset + _FIELD_LOSS], \
+                     "ties" : counters[offset + _FIELD_TIE], \
+                     "goalDifferential" : counters[offset + _FIELD_GOALS] } }
 
     def toDictionary(self):
         resultArr = []
-        for rel in self.gamesPlayed:
-            if (rel != "against"):
-                for rval in self.gamesPlayed[rel]:
-                    if (rel != "with"  or  len(rval) == 0):
-                        resultArr.append(self.typeToDictionary(rel, rval))
+        for cat in _CATEGORY_ORDER:
+            if (self.catMask & (1 << cat)):
+                resultArr.append(self.typeToDictionary(_CATEGORIES[cat][0], _CATEGORIES[cat][1]))
         return { "player" : self.name, "stats" : resultArr }
 
     @staticmethod
@@ -186,30 +985,909 @@ class PlayerStats(object):
         result = ""
         if (showHeader):
             result = PlayerStats.header(PlayerStats.categoryString(rel, rval))
-        if (not showZeros  and  self.gamesPlayed[rel][rval] == 0):
+        (counters, offset) = self._counters(rel, rval)
+        if (not showZeros  and  counters[offset + _FIELD_PLAYED] == 0):
             return result
         result += (self.name + ":") if (showName) else "\t"   # header() starts with tab for this
-        for outcome in ("win", "loss", "tie"):
-            result += separator + str(self.gameResults[outcome][rel][rval])
-        if (self.gamesPlayed[rel][rval] != 0):
-            result += separator + "%4.1f" % ((100.0 * self.gameResults["win"][rel][rval]) / self.gamesPlayed[rel][rval])
+        for field in (_FIELD_WIN, _FIELD_LOSS, _FIELD_TIE):
+            result += separator + str(counters[offset + field])
+        if (counters[offset + _FIELD_PLAYED] != 0):
+            result += separator + "%4.1f" % ((100.0 * counters[offset + _FIELD_WIN]) / counters[offset + _FIELD_PLAYED])
         else:
             result += separator + "---"
-        result += separator + str(self.goalDelta[rel][rval])
+        result += separator + str(counters[offset + _FIELD_GOALS])
         result += "\n"
         return result
 
 
+## Tallies every game for every player in statsById with a single scan of the Game table
+## (rather than two joined queries per player via PlayerStats.tally).
+def _tallyGames(statsById, rows):
+    for row in rows:
+        redRow = (row[0], row[1], row[2], row[3], row[4], row[5])
+        blackRow = (row[1], row[0], row[4], row[5], row[2], row[3])
+        for (colorAs, sideRow) in (("red", redRow), ("black", blackRow)):
+            for playerId in set((sideRow[2], sideRow[3])):
+                if (playerId in statsById):
+                    statsById[playerId].tallyGame(colorAs, sideRow + (playerId,))
+
+
+## Same tallies as _tallyGames, computed with NumPy over whole columns at once.  games is an integer array with one
+## row per game of (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense).
+## Tallies against two-player opposing teams are left out:  nothing reports or summarizes them, and with one key per
+## (player, team) they would outnumber everything else put together.
+def _tallyGamesNumpy(statsById, games):
+    numGames = games.shape[0]
+    if (numGames == 0  or  len(statsById) == 0):
+        return
+    games = games.astype(numpy.int64)
+    playerIds = numpy.array(sorted(statsById), dtype=numpy.int64)
+    numPlayers = len(playerIds)
+    base = int(max(games.max(), playerIds.max())) + 1        ## For packing (player, other[, other]) into one key.
+    totals = numpy.zeros((len(_CATEGORIES), numPlayers, _NUM_FIELDS), dtype=numpy.int64)
+    pairKeys = { "with" : [], "against" : [] }
+    pairFields = { "with" : [], "against" : [] }
+    for (cat, cols) in ((_CAT_RED, (0, 1, 2, 3, 4, 5)), (_CAT_BLACK, (1, 0, 4, 5, 2, 3))):
+        (asScore, againstScore, asOffense, asDefense, againstOffense, againstDefense) = [games[:, col] for col in cols]
+        ## One entry per (game, player on this side); a solo player counts once.
+        twoPlayers = (asOffense != asDefense)
+        gameIdx = numpy.concatenate((numpy.arange(numGames), numpy.nonzero(twoPlayers)[0]))
+        pid = numpy.concatenate((asOffense, asDefense[twoPlayers]))
+        pidx = numpy.minimum(numpy.searchsorted(playerIds, pid), numPlayers - 1)
+        known = (playerIds[pidx] == pid)
+        (gameIdx, pid, pidx) = (gameIdx[known], pid[known], pidx[known])
+        (scoreFor, scoreAgainst) = (asScore[gameIdx], againstScore[gameIdx])
+        fields = numpy.zeros((len(pid), _NUM_FIELDS), dtype=numpy.int64)
+        fields[:, _FIELD_PLAYED] = 1
+        fields[:, _FIELD_WIN] = (scoreFor > scoreAgainst)
+        fields[:, _FIELD_LOSS] = (scoreFor < scoreAgainst)
+        fields[:, _FIELD_TIE] = (scoreFor == scoreAgainst)
+        fields[:, _FIELD_GOALS] = scoreFor - scoreAgainst
+        colorTotals = _sumFields(pidx, fields, numPlayers)
+        totals[cat] += colorTotals
+        totals[_CAT_OVERALL] += colorTotals
+        (offense, defense) = (asOffense[gameIdx], asDefense[gameIdx])
+        solo = (offense == defense)
+        totals[_CAT_SOLO] += _sumFields(pidx[solo], fields[solo], numPlayers)
+        partner = numpy.where(defense == pid, offense, defense)
+        pairKeys["with"].append(pid[~solo] * base + partner[~solo])
+        pairFields["with"].append(fields[~solo])
+        (oppOffense, oppDefense) = (againstOffense[gameIdx], againstDefense[gameIdx])
+        soloOpp = (oppOffense == oppDefense)
+        opponent = numpy.where(oppOffense == pid, offense, oppOffense)
+        pairKeys["against"].append(pid[soloOpp] * base + opponent[soloOpp])
+        pairFields["against"].append(fields[soloOpp])
+    for (i, playerId) in enumerate(playerIds.tolist()):
+        ps = statsById[playerId]
+        for cat in _CATEGORY_ORDER:
+            if (totals[cat][i][_FIELD_PLAYED] > 0):
+                ps.addTotals(_CATEGORIES[cat][0], _CATEGORIES[cat][1], *totals[cat][i].tolist())
+    for rel in ("with", "against"):
+        ## Keys come back sorted, so each player's partners / opponents are one contiguous run.
+        (keys, keyTotals) = _groupFields(numpy.concatenate(pairKeys[rel]), numpy.concatenate(pairFields[rel]))
+        owners = keys // base
+        bounds = numpy.searchsorted(owners, playerIds)
+        bounds = numpy.append(bounds, len(keys))
+        for (i, playerId) in enumerate(playerIds.tolist()):
+            (lo, hi) = (bounds[i], bounds[i + 1])
+            if (hi > lo):
+                statsById[playerId].addPairTotals(rel, (keys[lo:hi] % base).tolist(), keyTotals[lo:hi].tolist())
+
+
+def _sumFields(index, fields, size):
+    result = numpy.zeros((size, _NUM_FIELDS), dtype=numpy.int64)
+    result[:, _FIELD_PLAYED] = numpy.bincount(index, minlength=size)
+    for field in (_FIELD_WIN, _FIELD_LOSS, _FIELD_TIE, _FIELD_GOALS):
+        result[:, field] = numpy.rint(numpy.bincount(index, weights=fields[:, field], minlength=size))
+    return result
 
-def _postSlackMessage(msg):
+
+def _groupFields(keys, fields):
+    (uniqueKeys, inverse) = numpy.unique(keys, return_inverse=True)
+    return (uniqueKeys, _sumFields(inverse.ravel(), fields, len(uniqueKeys)))
+
+
+def _statsEngine():
+    global _g_config
+    engine = _g_config.get("statsEngine", "python")
+    if (engine == "numpy"  and  numpy is None):
+        app.logger.warning("statsEngine is 'numpy' but NumPy is not installed; using the python engine.")
+        return "python"
+    return engine
+
+
+def _tallyAllPlayers(stats, db, timeRange = None, chunkSize = 10000):
+    statsById = {}
+    for ps in stats:
+        statsById[ps.playerId] = ps
+    engine = _statsEngine()
+    query = "SELECT redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense FROM Game"
+    args = []
+    if (timeRange is not None):
+        (condition, args) = _timeRangeCondition(timeRange, "timestamp")
+        query += " WHERE " + condition
+    cursor = _storage().streamingCursor(db)
+    try:
+        cursor.execute(query, args)
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(chunkSize)
+            if (not rows):
+                break
+            if (engine == "numpy"):
+                chunks.append(numpy.array(rows, dtype=numpy.int64).reshape(-1, 6))
+            else:
+                _tallyGames(statsById, rows)
+        if (engine == "numpy"  and  len(chunks) > 0):
+            _tallyGamesNumpy(statsById, numpy.concatenate(chunks))
+    except Exception as e:
+        app.logger.error("Caught exception tallying stats for all players:  " + str(e))
+        return False
+    finally:
+        cursor.close()
+    return True
+
+
+####################
+## Summary Tables ##
+####################
+
+## PlayerSummary and PairSummary hold running totals per player so stats requests don't replay all of Game.
+## They are updated in the same transaction as each INSERT INTO Game, and can be regenerated with _rebuildSummary().
+
+_SUMMARY_COLUMNS = ("gamesPlayed", "wins", "losses", "ties", "goalDelta")
+
+def _writeSummary(cursor, stats):
+    categoryRows = []
+    pairRows = []
+    for ps in stats:
+        (psCategoryRows, psPairRows) = ps.summaryRows()
+        categoryRows.extend(psCategoryRows)
+        pairRows.extend(psPairRows)
+    storage = _storage()
+    if (len(categoryRows) > 0):
+        cursor.executemany(storage.upsert("PlayerSummary", ("playerId", "rel", "rval"), _SUMMARY_COLUMNS, True), categoryRows)
+    if (len(pairRows) > 0):
+        cursor.executemany(storage.upsert("PairSummary", ("playerId", "rel", "otherId"), _SUMMARY_COLUMNS, True), pairRows)
+
+
+## rows are (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense); caller commits.
+def _updateSummary(cursor, rows):
+    statsById = {}
+    for row in rows:
+        for playerId in (row[2], row[3], row[4], row[5]):
+            if (playerId not in statsById):
+                statsById[playerId] = PlayerStats("", playerId)
+    _tallyGames(statsById, rows)
+    _writeSummary(cursor, statsById.values())
+
+
+def _rebuildSummary(db):
+    cursor = db.cursor()
+    try:
+        ## Deleting first locks the summary rows, so a game recorded during the rebuild either is part of the
+        ## tally below or waits and adds itself on top once this commits.
+        cursor.execute("DELETE FROM PairSummary")
+        cursor.execute("DELETE FROM PlayerSummary")
+        stats = []
+        for row in _storage().allPlayers(cursor):
+            stats.append(PlayerStats(row[1], int(row[0])))
+        if (not _tallyAllPlayers(stats, db)):
+            db.rollback()
+            return False
+        _writeSummary(cursor, stats)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error("Caught exception rebuilding summary tables:  " + str(e))
+        return False
+    return True
+
+
+def _loadSummary(db, stats):
+    statsById = {}
+    for ps in stats:
+        statsById[ps.playerId] = ps
+    query = "SELECT playerId, rel, rval, gamesPlayed, wins, losses, ties, goalDelta FROM PlayerSummary"
+    args = []
+    if (len(stats) == 1):
+        query += " WHERE playerId = %s"
+        args.append(int(stats[0].playerId))
+    cursor = db.cursor()
+    try:
+        cursor.execute(query, args)
+        for row in cursor.fetchall():
+            if (int(row[0]) in statsById):
+                statsById[int(row[0])].addTotals(row[1], row[2], row[3], row[4], row[5], row[6], row[7])
+    except Exception as e:
+        app.logger.error("Caught exception loading summary stats:  " + str(e))
+        return False
+    return True
+
+
+def _loadPairSummary(db, ps, otherId):
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT rel, gamesPlayed, wins, losses, ties, goalDelta FROM PairSummary WHERE playerId = %s AND otherId = %s", \
+                       (int(ps.playerId), int(otherId)))
+        for row in cursor.fetchall():
+            ps.addTotals(row[0], str(otherId), row[1], row[2], row[3], row[4], row[5])
+    except Exception as e:
+        app.logger.error("Caught exception loading pair stats for '" + ps.name + "':  " + str(e))
+        return False
+    return True
+
+
+
+####################
+## Team Summaries ##
+####################
+
+## TeamSummary holds running totals for each two-player team, keyed by its players' ids in ascending order and defenseId
+## (0 for all the team's games, otherwise those it played with that player on defense).  TeamVersusSummary holds a team's
+## totals against each opposing side, another team or one player playing both positions (opponent1Id = opponent2Id).
+## Both are kept like PlayerSummary:  updated with each game and regenerated with _rebuildTeamSummary().
+
+def _teamKey(playerId1, playerId2):
+    return (min(int(playerId1), int(playerId2)), max(int(playerId1), int(playerId2)))
+
+
+def _addResult(totals, key, score, oppScore):
+    counters = totals.get(key)
+    if (counters is None):
+        counters = totals[key] = [0] * _NUM_FIELDS
+    counters[_FIELD_PLAYED] += 1
+    if (score > oppScore):
+        counters[_FIELD_WIN] += 1
+    elif (score < oppScore):
+        counters[_FIELD_LOSS] += 1
+    else:
+        counters[_FIELD_TIE] += 1
+    counters[_FIELD_GOALS] += score - oppScore
+
+
+## rows as for _tallyGames.  Team totals are keyed (player1Id, player2Id, defenseId), versus totals
+## (player1Id, player2Id, opponent1Id, opponent2Id).
+def _tallyTeams(rows, teamTotals, versusTotals):
+    for row in rows:
+        for (score, oppScore, offense, defense, oppOffense, oppDefense) in ((row[0], row[1], row[2], row[3], row[4], row[5]), \
+                                                                          (row[1], row[0], row[4], row[5], row[2], row[3])):
+            if (offense == defense):
+                continue
+            team = _teamKey(offense, defense)
+            _addResult(teamTotals, team + (0,), score, oppScore)
+            _addResult(teamTotals, team + (int(defense),), score, oppScore)
+            _addResult(versusTotals, team + _teamKey(oppOffense, oppDefense), score, oppScore)
+
+
+def _writeTeamSummary(cursor, teamTotals, versusTotals):
+    storage = _storage()
+    if (len(teamTotals) > 0):
+        cursor.executemany(storage.upsert("TeamSummary", ("player1Id", "player2Id", "defenseId"), _SUMMARY_COLUMNS, True), \
+                           [ key + tuple(counters) for (key, counters) in teamTotals.items() ])
+    if (len(versusTotals) > 0):
+        cursor.executemany(storage.upsert("TeamVersusSummary", ("player1Id", "player2Id", "opponent1Id", "opponent2Id"), _SUMMARY_COLUMNS, True), \
+                           [ key + tuple(counters) for (key, counters) in versusTotals.items() ])
+
+
+## Caller commits.
+def _updateTeamSummary(cursor, rows):
+    teamTotals = {}
+    versusTotals = {}
+    _tallyTeams(rows, teamTotals, versusTotals)
+    _writeTeamSummary(cursor, teamTotals, versusTotals)
+
+
+def _rebuildTeamSummary(db, chunkSize = 10000):
+    cursor = db.cursor()
+    teamTotals = {}
+    versusTotals = {}
+    try:
+        cursor.execute("DELETE FROM TeamVersusSummary")
+        cursor.execute("DELETE FROM TeamSummary")
+        gameCursor = _storage().streamingCursor(db)
+        gameCursor.execute("SELECT redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense FROM Game " \
+                           "WHERE redOffense <> redDefense  OR  blackOffense <> blackDefense")
+        while True:
+            rows = gameCursor.fetchmany(chunkSize)
+            if (not rows):
+                break
+            _tallyTeams(rows, teamTotals, versusTotals)
+        gameCursor.close()
+        _writeTeamSummary(cursor, teamTotals, versusTotals)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error("Caught exception rebuilding team summary tables:  " + str(e))
+        return False
+    return True
+
+
+class TeamStats(object):
+    def __init__(self, names, playerIds):       ## names and ids of the two players, in ascending id order
+        self.names = names
+        self.playerIds = playerIds
+        self.name = names[0] + "+" + names[1]
+        self.totals = {}
+
+    def addTotals(self, category, gamesPlayed, wins, losses, ties, goalDelta):
+        counters = self.totals.setdefault(category, [0] * _NUM_FIELDS)
+        for (field, value) in zip(range(_NUM_FIELDS), (gamesPlayed, wins, losses, ties, goalDelta)):
+            counters[field] += int(value)
+
+    def defenseCategory(self, defenseId):
+        if (int(defenseId) == 0):
+            return "overall"
+        return self.names[self.playerIds.index(int(defenseId))] + " on defense"
+
+    def categories(self):
+        return [ "overall" ] + [ self.defenseCategory(playerId) for playerId in self.playerIds ]
+
+    def typeToDictionary(self, category):
+        counters = self.totals.get(category, [0] * _NUM_FIELDS)
+        return { "category" : category, \
+                 "categoryStats" : { \
+                     "gamesPlayed" : counters[_FIELD_PLAYED], \
+                     "wins" : counters[_FIELD_WIN], \
+                     "losses" : counters[_FIELD_LOSS], \
+                     "ties" : counters[_FIELD_TIE], \
+                     "goalDifferential" : counters[_FIELD_GOALS] } }
+
+    def typeToString(self, category, showHeader = True, separator = "\t"):
+        result = PlayerStats.header(category) if (showHeader) else ""
+        counters = self.totals.get(category, [0] * _NUM_FIELDS)
+        result += self.name + ":"
+        for field in (_FIELD_WIN, _FIELD_LOSS, _FIELD_TIE):
+            result += separator + str(counters[field])
+        if (counters[_FIELD_PLAYED] != 0):
+            result += separator + "%4.1f" % ((100.0 * counters[_FIELD_WIN]) / counters[_FIELD_PLAYED])
+        else:
+            result += separator + "---"
+        result += separator + str(counters[_FIELD_GOALS])
+        result += "\n"
+        return result
+
+
+## Returns (condition, args) matching the games playerIds played together on either side.
+def _teamGameCondition(playerIds, prefix = "G."):
+    (p1, p2) = (int(playerIds[0]), int(playerIds[1]))
+    conditions = []
+    args = []
+    for color in ("red", "black"):
+        conditions.append("(" + prefix + color + "Offense = %s  AND  " + prefix + color + "Defense = %s)")
+        conditions.append("(" + prefix + color + "Offense = %s  AND  " + prefix + color + "Defense = %s)")
+        args.extend((p1, p2, p2, p1))
+    return ("(" + "  OR  ".join(conditions) + ")", args)
+
+
+## Loads team's totals, and with opponentIds (an ascending id pair, equal for a single player) its totals against that
+## side.  All-time totals come from the summary tables; a time range replays the team's games in that range.
+def _loadTeam(db, team, timeRange = None, opponentIds = None, category = None):
+    cursor = db.cursor()
+    try:
+        if (timeRange is None):
+            cursor.execute("SELECT defenseId, gamesPlayed, wins, losses, ties, goalDelta FROM TeamSummary " \
+                           "WHERE player1Id = %s  AND  player2Id = %s", tuple(team.playerIds))
+            for row in cursor.fetchall():
+                team.addTotals(team.defenseCategory(row[0]), *row[1:])
+            if (opponentIds is not None):
+                cursor.execute("SELECT gamesPlayed, wins, losses, ties, goalDelta FROM TeamVersusSummary " \
+                               "WHERE player1Id = %s  AND  player2Id = %s  AND  opponent1Id = %s  AND  opponent2Id = %s", \
+                               tuple(team.playerIds) + (int(opponentIds[0]), int(opponentIds[1])))
+                for row in cursor.fetchall():
+                    team.addTotals(category, *row)
+            return True
+        (teamCondition, teamArgs) = _teamGameCondition(team.playerIds)
+        (rangeCondition, rangeArgs) = _timeRangeCondition(timeRange, "G.timestamp")
+        cursor.execute("SELECT G.redScore, G.blackScore, G.redOffense, G.redDefense, G.blackOffense, G.blackDefense FROM Game AS G " \
+                       "WHERE " + teamCondition + "  AND  " + rangeCondition, teamArgs + rangeArgs)
+        teamTotals = {}
+        versusTotals = {}
+        _tallyTeams(cursor.fetchall(), teamTotals, versusTotals)
+        for defenseId in [ 0 ] + list(team.playerIds):
+            key = tuple(team.playerIds) + (defenseId,)
+            if (key in teamTotals):
+                team.addTotals(team.defenseCategory(defenseId), *teamTotals[key])
+        if (opponentIds is not None):
+            key = tuple(team.playerIds) + tuple(opponentIds)
+            if (key in versusTotals):
+                team.addTotals(category, *versusTotals[key])
+    except Exception as e:
+        app.logger.error("Caught exception loading team stats for '" + team.name + "':  " + str(e))
+        return False
+    return True
+
+
+####################
+## Stats Snapshot ##
+####################
+
+## With snapshot.file set, the all-time summary is also published as a compact binary file that every worker process
+## memory-maps, so /stats is served from one shared copy instead of each worker querying the summary tables.  Writes
+## don't touch it:  the next reader that finds it behind the database's data version rewrites it (to a temporary file,
+## then renamed over the old one), one thread per worker at a time, and the others use the tables meanwhile.
+##
+## Layout (little-endian):  header, then the players in Player table order, the category rows and the pair rows of each
+## player in turn (in summary table key order, which keeps the output identical to the table path), and the UTF-8 names.
+
+_SNAPSHOT_MAGIC = b"FSS1"
+_SNAPSHOT_HEADER = struct.Struct("<4sqqIII")          ## magic, lastGameId, playerVersion, players, category rows, pair rows
+_SNAPSHOT_PLAYER = struct.Struct("<iIIIIII")          ## playerId, name offset, name length, first category row, count, first pair row, count
+_SNAPSHOT_CATEGORY = struct.Struct("<B5i")            ## index into _CATEGORIES, counters
+_SNAPSHOT_PAIR = struct.Struct("<Bi5i")               ## 0 "with" / 1 "against", other player's id, counters
+_SNAPSHOT_PAIR_RELS = ("with", "against")
+
+
+def _snapshotFile():
+    return _g_config.get("snapshot", {}).get("file", "")
+
+
+def _versionAtLeast(version, other):
+    return all(v >= o for (v, o) in zip(version, other))
+
+
+def _writeSnapshot(db, path, force = False):
+    cursor = db.cursor()
+    ## One transaction, so the version and the rows agree.
+    version = _dataVersion(db)
+    if (not force  and  os.path.exists(path)  and  _versionAtLeast(_mappedSnapshot(path).version, version)):
+        db.rollback()
+        return                                      ## Another worker got there first.
+    players = [ (int(row[0]), row[1]) for row in _storage().allPlayers(cursor) ]
+    categoryRows = {}
+    cursor.execute("SELECT playerId, rel, rval, gamesPlayed, wins, losses, ties, goalDelta FROM PlayerSummary ORDER BY playerId, rel, rval")
+    for row in cursor.fetchall():
+        categoryRows.setdefault(int(row[0]), []).append(_SNAPSHOT_CATEGORY.pack(_CATEGORIES.index((row[1], row[2])), *[ int(v) for v in row[3:8] ]))
+    pairRows = {}
+    cursor.execute("SELECT playerId, rel, otherId, gamesPlayed, wins, losses, ties, goalDelta FROM PairSummary ORDER BY playerId, rel, otherId")
+    for row in cursor.fetchall():
+        pairRows.setdefault(int(row[0]), []).append(_SNAPSHOT_PAIR.pack(_SNAPSHOT_PAIR_RELS.index(row[1]), *[ int(v) for v in row[2:8] ]))
+    index = []
+    categories = []
+    pairs = []
+    names = []
+    nameOffset = 0
+    for (playerId, name) in players:
+        encoded = name.encode("utf-8") if (isinstance(name, type(u""))) else name
+        playerCategories = categoryRows.get(playerId, [])
+        playerPairs = pairRows.get(playerId, [])
+        index.append(_SNAPSHOT_PLAYER.pack(playerId, nameOffset, len(encoded), len(categories), len(playerCategories), len(pairs), len(playerPairs)))
+        categories.extend(playerCategories)
+        pairs.extend(playerPairs)
+        names.append(encoded)
+        nameOffset += len(encoded)
+    db.rollback()
+    (fd, tmpPath) = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, version[0], version[1], len(players), len(categories), len(pairs)))
+            f.write(b"".join(index))
+            f.write(b"".join(categories))
+            f.write(b"".join(pairs))
+            f.write(b"".join(names))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmpPath, 0o644)                    ## mkstemp makes it private to this user.
+        os.rename(tmpPath, path)
+    except Exception:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        raise
+
+
+class StatsSnapshot(object):
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.identity = os.fstat(f.fileno()).st_ino
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, lastGameId, playerVersion, self.numPlayers, numCategories, numPairs) = _SNAPSHOT_HEADER.unpack_from(self.data, 0)
+        if (magic != _SNAPSHOT_MAGIC):
+            raise ValueError("not a stats snapshot:  " + path)
+        self.version = (lastGameId, playerVersion)
+        self.playersAt = _SNAPSHOT_HEADER.size
+        self.categoriesAt = self.playersAt + self.numPlayers * _SNAPSHOT_PLAYER.size
+        self.pairsAt = self.categoriesAt + numCategories * _SNAPSHOT_CATEGORY.size
+        self.namesAt = self.pairsAt + numPairs * _SNAPSHOT_PAIR.size
+
+    def _player(self, i):
+        return _SNAPSHOT_PLAYER.unpack_from(self.data, self.playersAt + i * _SNAPSHOT_PLAYER.size)
+
+    def _find(self, playerId):
+        for i in range(self.numPlayers):
+            entry = self._player(i)
+            if (entry[0] == int(playerId)):
+                return entry
+        return None
+
+    def _fill(self, ps, entry):
+        for i in range(entry[3], entry[3] + entry[4]):
+            row = _SNAPSHOT_CATEGORY.unpack_from(self.data, self.categoriesAt + i * _SNAPSHOT_CATEGORY.size)
+            ps.addTotals(_CATEGORIES[row[0]][0], _CATEGORIES[row[0]][1], *row[1:])
+
+    def allStats(self):
+        stats = []
+        for i in range(self.numPlayers):
+            entry = self._player(i)
+            name = self.data[self.namesAt + entry[1]:self.namesAt + entry[1] + entry[2]].decode("utf-8")
+            ps = PlayerStats(name, entry[0])
+            self._fill(ps, entry)
+            stats.append(ps)
+        return stats
+
+    def loadPlayer(self, ps):
+        entry = self._find(ps.playerId)
+        if (entry is not None):
+            self._fill(ps, entry)
+        return True
+
+    def loadPair(self, ps, otherId):
+        entry = self._find(ps.playerId)
+        if (entry is None):
+            return True
+        for i in range(entry[5], entry[5] + entry[6]):
+            row = _SNAPSHOT_PAIR.unpack_from(self.data, self.pairsAt + i * _SNAPSHOT_PAIR.size)
+            if (row[1] == int(otherId)):
+                ps.addTotals(_SNAPSHOT_PAIR_RELS[row[0]], str(otherId), *row[2:])
+        return True
+
+
+_g_snapshot = None
+_g_snapshotLock = threading.Lock()
+_g_snapshotWriteLock = threading.Lock()
+_g_snapshotForce = False
+
+
+def _mappedSnapshot(path):
+    global _g_snapshot
+    with _g_snapshotLock:
+        identity = os.stat(path).st_ino
+        if (_g_snapshot is None  or  _g_snapshot.identity != identity):
+            _g_snapshot = StatsSnapshot(path)        ## The old mapping is released once no request holds it.
+        return _g_snapshot
+
+
+## After rebuilding the summary tables, which leaves the data version as it was:  has the next read rewrite the snapshot.
+def _markSnapshotStale():
+    global _g_snapshotForce
+    _g_snapshotForce = True
+
+
+## Returns None when snapshots are off or one matching the database can't be had; callers then use the summary tables.
+def _currentSnapshot(db):
+    global _g_snapshotForce
+    path = _snapshotFile()
+    if (len(path) == 0):
+        return None
+    try:
+        version = _dataVersion(db)
+        snapshot = _mappedSnapshot(path) if (os.path.exists(path)) else None
+        if (_g_snapshotForce  or  snapshot is None  or  not _versionAtLeast(snapshot.version, version)):
+            if (not _g_snapshotWriteLock.acquire(False)):
+                return None                         ## Another thread is rewriting it.
+            try:
+                force = _g_snapshotForce
+                _g_snapshotForce = False
+                try:
+                    _writeSnapshot(db, path, force)
+                except Exception:
+                    _g_snapshotForce = _g_snapshotForce  or  force
+                    raise
+            finally:
+                _g_snapshotWriteLock.release()
+            snapshot = _mappedSnapshot(path)
+        return snapshot if (_versionAtLeast(snapshot.version, version)) else None
+    except Exception as e:
+        app.logger.error("Caught exception reading the stats snapshot:  " + str(e))
+        return None
+
+
+#############
+## Ratings ##
+#############
+
+## Elo-style skill ratings.  A side's rating is the average of its players' ratings (a solo player counts once); after
+## each game every player on a side moves by K * (actual - expected), where actual is 1, 0.5 or 0.  _game and _bulkGames
+## apply new games to the Rating table in the same transaction that inserts them, and RatingState records the last
+## game id applied.
+
+def _ratingSettings():
     global _g_config
-    apiURL = "https://slack.com/api/chat.postMessage"
-    r = requests.post(apiURL, data={ 'token' : _g_config["slack"]["apiToken"], \
-                                     'channel' : _g_config["slack"]["channel"], \
-                                     'username' : _g_config["slack"]["postAsUser"], \
-                                     'text' : msg + "\n"})
-    if (r.status_code >= 300):
+    return (float(_g_config.get("ratingInitial", 1500.0)), float(_g_config.get("ratingK", 32.0)))
+
+
+## ratings:  {playerId : [rating, gamesRated]}, updated in place for the players in row
+## (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense).
+def _rateGame(ratings, row, initial, k):
+    sides = (set((row[2], row[3])), set((row[4], row[5])))
+    for side in sides:
+        for playerId in side:
+            if (playerId not in ratings):
+                ratings[playerId] = [initial, 0]
+    redRating = sum(ratings[playerId][0] for playerId in sides[0]) / len(sides[0])
+    blackRating = sum(ratings[playerId][0] for playerId in sides[1]) / len(sides[1])
+    expected = 1.0 / (1.0 + 10.0 ** ((blackRating - redRating) / 400.0))
+    actual = 1.0 if (row[0] > row[1]) else (0.0 if (row[0] < row[1]) else 0.5)
+    delta = k * (actual - expected)
+    for (side, sign) in ((sides[0], 1.0), (sides[1], -1.0)):
+        for playerId in side:
+            ratings[playerId][0] += sign * delta
+            ratings[playerId][1] += 1
+
+
+def _writeRatings(cursor, ratings, lastGameId):
+    storage = _storage()
+    if (len(ratings) > 0):
+        cursor.executemany(storage.upsert("Rating", ("playerId",), ("rating", "gamesRated")), \
+                           [ (playerId, ratings[playerId][0], ratings[playerId][1]) for playerId in ratings ])
+    cursor.execute(storage.upsert("RatingState", ("id",), ("lastGameId",), greatest=True), (1, int(lastGameId)))   ## Never moves back.
+
+
+## Applies newly inserted games, a list of (gameId, row) in id order; caller commits.
+def _updateRatings(cursor, games):
+    (initial, k) = _ratingSettings()
+    playerIds = set()
+    for (gameId, row) in games:
+        playerIds.update(row[2:6])
+    ratings = {}
+    _storage().selectForUpdate(cursor, "SELECT playerId, rating, gamesRated FROM Rating WHERE playerId IN (" + ", ".join([ "%s" ] * len(playerIds)) + ")", \
+                               [ int(p) for p in playerIds ])
+    for rating in cursor.fetchall():
+        ratings[int(rating[0])] = [float(rating[1]), int(rating[2])]
+    for (gameId, row) in games:
+        _rateGame(ratings, row, initial, k)
+    _writeRatings(cursor, ratings, games[-1][0])
+
+
+## Replays Game in id order in one streaming pass.  With fromScratch False, carries on from the RatingState checkpoint
+## (see _catchUpRatings).
+def _rebuildRatings(db, fromScratch = True, chunkSize = 10000):
+    (initial, k) = _ratingSettings()
+    ratings = {}
+    lastGameId = 0
+    cursor = db.cursor()
+    try:
+        if (fromScratch):
+            cursor.execute("DELETE FROM Rating")
+        else:
+            ## Rating, then RatingState:  the order _updateRatings locks them in.
+            _storage().selectForUpdate(cursor, "SELECT playerId, rating, gamesRated FROM Rating")
+            for rating in cursor.fetchall():
+                ratings[int(rating[0])] = [float(rating[1]), int(rating[2])]
+            _storage().selectForUpdate(cursor, "SELECT lastGameId FROM RatingState WHERE id = 1")
+            state = cursor.fetchone()
+            lastGameId = int(state[0]) if (state is not None) else 0
+        gameCursor = _storage().streamingCursor(db)
+        gameCursor.execute("SELECT id, redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense FROM Game " \
+                           "WHERE id > %s ORDER BY id", (lastGameId,))
+        while True:
+            rows = gameCursor.fetchmany(chunkSize)
+            if (not rows):
+                break
+            for row in rows:
+                _rateGame(ratings, row[1:], initial, k)
+                lastGameId = int(row[0])
+        gameCursor.close()
+        _writeRatings(cursor, ratings, lastGameId)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error("Caught exception rebuilding ratings:  " + str(e))
+        return False
+    return True
+
+
+
+_g_ratingsCatchUpLock = threading.Lock()
+
+
+## Once per connection pool (so once per worker, and again if a config reload points it at another database), rates
+## any games past the checkpoint -- ones inserted without going through _game or _bulkGames, e.g. by a migration or a
+## hand-run import.  Run by every web and Slack request until it succeeds.
+def _catchUpRatings():
+    try:
+        pool = _connectionPool()
+        if (pool.ratingsCaughtUp):
+            return
+        with _g_ratingsCatchUpLock:
+            if (pool.ratingsCaughtUp):
+                return
+            db = _connectDB()
+            try:
+                pool.ratingsCaughtUp = _rebuildRatings(db, False)
+            finally:
+                db.close()
+    except Exception as e:
+        app.logger.error("Caught exception catching up ratings:  " + str(e))
+
+
+#######################
+## Game Participants ##
+#######################
+
+## GameParticipant has one row per (game, player, color, position) -- position 'D', 'O', or 'S' for a solo player --
+## so one player's games are an index range on (playerId, timestamp) rather than an OR over four Game columns.
+
+_PARTICIPANT_COLUMNS = "gameId, playerId, color, position, timestamp"
+
+
+def _participantRows(gameId, timestamp, redOffense, redDefense, blackOffense, blackDefense):
+    rows = []
+    for (color, offense, defense) in (("red", redOffense, redDefense), ("black", blackOffense, blackDefense)):
+        if (offense == defense):
+            rows.append((gameId, offense, color, "S", timestamp))
+        else:
+            rows.append((gameId, defense, color, "D", timestamp))
+            rows.append((gameId, offense, color, "O", timestamp))
+    return rows
+
+
+## Caller commits.
+def _insertParticipants(cursor, rows):
+    cursor.executemany("INSERT INTO GameParticipant (" + _PARTICIPANT_COLUMNS + ") VALUES (%s, %s, %s, %s, %s)", rows)
+
+
+_PARTICIPANT_BACKFILL = "INSERT INTO GameParticipant (" + _PARTICIPANT_COLUMNS + ") " \
+    "SELECT id, redOffense, 'red', 'S', timestamp FROM Game WHERE redOffense = redDefense UNION ALL " \
+    "SELECT id, redDefense, 'red', 'D', timestamp FROM Game WHERE redOffense <> redDefense UNION ALL " \
+    "SELECT id, redOffense, 'red', 'O', timestamp FROM Game WHERE redOffense <> redDefense UNION ALL " \
+    "SELECT id, blackOffense, 'black', 'S', timestamp FROM Game WHERE blackOffense = blackDefense UNION ALL " \
+    "SELECT id, blackDefense, 'black', 'D', timestamp FROM Game WHERE blackOffense <> blackDefense UNION ALL " \
+    "SELECT id, blackOffense, 'black', 'O', timestamp FROM Game WHERE blackOffense <> blackDefense"
+
+
+def _rebuildParticipants(db):
+    cursor = db.cursor()
+    try:
+        cursor.execute("DELETE FROM GameParticipant")
+        cursor.execute(_PARTICIPANT_BACKFILL)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        app.logger.error("Caught exception rebuilding game participants:  " + str(e))
+        return False
+    return True
+
+
+
+## Outbound Slack messages are handed to a background thread so requests don't wait on chat.postMessage.
+## Messages are delivered in order over one keep-alive session; a message that fails with a network error,
+## 5xx or rate limit stays at the head of the (bounded) queue and is retried with exponential backoff.
+class SlackDeliveryQueue(object):
+    def __init__(self, apiURL, maxSize = 1000, maxRetries = 5, retryBackoff = 1.0, maxBackoff = 60.0, timeout = 10.0):
+        self.apiURL = apiURL
+        self.maxSize = maxSize
+        self.maxRetries = maxRetries
+        self.retryBackoff = retryBackoff
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.messages = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.sending = False
+        self.stats = { "queued" : 0, "sent" : 0, "failed" : 0, "dropped" : 0, "retries" : 0, "rateLimited" : 0 }
+
+    def put(self, payload):
+        with self.cond:
+            if (len(self.messages) >= self.maxSize):
+                self.messages.popleft()
+                self.stats["dropped"] += 1
+                app.logger.warning("Slack delivery queue full; dropped the oldest message.")
+            self.messages.append(payload)
+            self.stats["queued"] += 1
+            if (self.thread is None  or  not self.thread.is_alive()):       ## Started lazily so each forked worker gets its own.
+                self.thread = threading.Thread(target=self._run, name="SlackDelivery")
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    ## Returns (delivered, retryAfterSeconds); retryAfterSeconds is None if the message should not be retried.
+    def _send(self, payload):
+        start = time.time()
+        try:
+            r = self.session.post(self.apiURL, data=payload, timeout=self.timeout)
+        except Exception as e:
+            _g_metrics.increment("foosball_slack_post_failures_total", reason="connection")
+            app.logger.warning("Posting to slack failed:  " + str(e))
+            return (False, 0)
+        finally:
+            _g_metrics.observe("foosball_slack_post_seconds", time.time() - start)
+        if (r.status_code == 429):
+            _g_metrics.increment("foosball_slack_post_failures_total", reason="ratelimited")
+            with self.cond:
+                self.stats["rateLimited"] += 1
+            return (False, float(r.headers.get("Retry-After", 1)))
+        if (r.status_code >= 300):
+            _g_metrics.increment("foosball_slack_post_failures_total", reason="http")
+            app.logger.warning("Posting to slack failed:  " + r.text)
+            return (False, 0 if (r.status_code >= 500) else None)
+        try:
+            body = r.json()
+        except Exception:
+            body = {}
+        if (body.get("ok", True)):
+            return (True, None)
+        if (body.get("error") == "ratelimited"):
+            _g_metrics.increment("foosball_slack_post_failures_total", reason="ratelimited")
+            with self.cond:
+                self.stats["rateLimited"] += 1
+            return (False, float(r.headers.get("Retry-After", 1)))
+        _g_metrics.increment("foosball_slack_post_failures_total", reason="api")
         app.logger.warning("Posting to slack failed:  " + r.text)
+        return (False, None)
+
+    def _run(self):
+        attempts = 0
+        while True:
+            with self.cond:
+                while (len(self.messages) == 0):
+                    self.sending = False
+                    self.cond.notify_all()
+                    self.cond.wait()
+                self.sending = True
+                payload = self.messages[0]
+            (delivered, retryAfter) = self._send(payload)
+            if (not delivered  and  retryAfter is not None  and  attempts < self.maxRetries):
+                attempts += 1
+                with self.cond:
+                    self.stats["retries"] += 1
+                time.sleep(max(retryAfter, min(self.maxBackoff, self.retryBackoff * (2 ** (attempts - 1)))))
+                continue
+            with self.cond:
+                if (len(self.messages) > 0  and  self.messages[0] is payload):
+                    self.messages.popleft()
+                self.stats["sent" if (delivered) else "failed"] += 1
+            attempts = 0
+
+    ## Waits up to timeout seconds for queued messages to be delivered (used at exit).
+    def flush(self, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            while ((len(self.messages) > 0  or  self.sending)  and  self.thread is not None  and  self.thread.is_alive()):
+                remaining = deadline - time.time()
+                if (remaining <= 0):
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def statistics(self):
+        with self.cond:
+            result = dict(self.stats)
+            result["pending"] = len(self.messages)
+        return result
+
+
+_g_slackQueue = None
+_g_slackQueueLock = threading.Lock()
+
+
+def _slackQueue():
+    global _g_config
+    global _g_slackQueue
+    with _g_slackQueueLock:
+        if (_g_slackQueue is None):
+            slackConfig = _g_config["slack"]
+            _g_slackQueue = SlackDeliveryQueue(slackConfig.get("apiURL", "https://slack.com/api/chat.postMessage"), \
+                                               int(slackConfig.get("queueSize", 1000)), \
+                                               int(slackConfig.get("maxRetries", 5)), \
+                                               float(slackConfig.get("retryBackoff", 1.0)))
+        return _g_slackQueue
+
+
+@atexit.register
+def _flushSlackQueue():
+    if (_g_slackQueue is not None):
+        _g_slackQueue.flush(5.0)
+
+
+def _postSlackMessage(msg):
+    global _g_config
+    _slackQueue().put({ 'token' : _g_config["slack"]["apiToken"], \
+                        'channel' : _g_config["slack"]["channel"], \
+                        'username' : _g_config["slack"]["postAsUser"], \
+                        'text' : msg + "\n"})
 
 
 def _postInsult(db, winnerId, loserId, losingColor):
@@ -217,9 +1895,7 @@ def _postInsult(db, winnerId, loserId, losingColor):
     if (loser == "steve"):
         return False
     try:
-        lines = []
-        for line in open(_g_config["insultFile"]):
-            lines.append(line)
+        lines = _g_insults
         if (len(lines) > 0):
             insult = lines[random.randint(0, len(lines) - 1)].replace("<loser/>", loser).replace("<winner/>", _playerIdToName(db, winnerId)).replace("<losingColor/>", losingColor)
             _postSlackMessage(insult + "\n")
@@ -228,53 +1904,161 @@ def _postInsult(db, winnerId, loserId, losingColor):
     return True
 
 
-def _isAscii(s):
-    return all(ord(c) < 128 for c in s)
-
-def _sqlOk(s):
-    return (_isAscii(s)  and  "'" not in s)
+## Process-local name <-> id map of the (small) Player table.  It is loaded on first use, kept current by _newPlayer and
+## _changePlayer, and reloaded after playerCacheTTL seconds so renames made by other worker processes are picked up.
+## Misses fall back to the database.
+class PlayerCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loadedAt = None
+        self.idsByName = {}
+        self.namesById = {}
+
+    def _ensureLoaded(self, db):
+        ttl = float(_g_config.get("playerCacheTTL", 60))
+        with self.lock:
+            if (self.loadedAt is not None  and  time.time() - self.loadedAt < ttl):
+                return
+        idsByName = {}
+        namesById = {}
+        cursor = db.cursor()
+        try:
+            for row in _storage().allPlayers(cursor):
+                idsByName[row[1]] = int(row[0])
+                namesById[int(row[0])] = row[1]
+        except Exception as e:
+            app.logger.error("Caught exception loading the player cache:  " + str(e))
+            return
+        with self.lock:
+            self.idsByName = idsByName
+            self.namesById = namesById
+            self.loadedAt = time.time()
+
+    def playerId(self, db, playerName):
+        self._ensureLoaded(db)
+        with self.lock:
+            return self.idsByName.get(playerName)
+
+    def playerName(self, db, playerId):
+        self._ensureLoaded(db)
+        with self.lock:
+            return self.namesById.get(int(playerId))
+
+    def add(self, playerId, playerName, lookupName = None):     ## lookupName:  how it was asked for, if it matched case-insensitively
+        with self.lock:
+            self.idsByName[playerName] = int(playerId)
+            if (lookupName is not None):
+                self.idsByName[lookupName] = int(playerId)
+            self.namesById[int(playerId)] = playerName
+
+    def rename(self, playerId, newName):
+        with self.lock:
+            for (name, cachedId) in list(self.idsByName.items()):
+                if (cachedId == int(playerId)):
+                    del self.idsByName[name]
+            self.idsByName[newName] = int(playerId)
+            self.namesById[int(playerId)] = newName
+
+
+_g_playerCache = PlayerCache()
 
 
 def _checkPlayer(db, playerName):
-    if (not _sqlOk(playerName)):
-        abort(401)
-    cursor = db.cursor()
-    try:
-        cursor.execute("SELECT * FROM Player WHERE name = '" + str(playerName) + "'")
-        hitname = cursor.fetchone()
-        if (hitname is not None  and  len(hitname) > 0):
-            return True
-    except Exception as e:
-        app.logger.error(" Caught exception in _checkPlayer for '" + str(playerName) + "':  " + str(e))
-    return False
+    return (_playerId(db, playerName) != -1)
 
 
 def _playerId(db, playerName):
-    if (not _sqlOk(playerName)):
-        abort(401)
+    cachedId = _g_playerCache.playerId(db, playerName)
+    if (cachedId is not None):
+        return cachedId
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT id FROM Player WHERE name = '" + str(playerName) + "'")
-        hitname = cursor.fetchone()
+        hitname = _storage().findPlayer(cursor, playerName)
         if (hitname is not None  and  len(hitname) > 0):
+            _g_playerCache.add(hitname[0], hitname[1], playerName)
             return int(hitname[0])
     except Exception as e:
-        app.logger.error("Caught exception in _playerId for '" + str(playerName) + "':  " + str(e))
+        app.logger.error("Caught exception in _playerId for '" + playerName + "':  " + str(e))
     return -1
 
 
 def _playerIdToName(db, playerId):
+    cachedName = _g_playerCache.playerName(db, playerId)
+    if (cachedName is not None):
+        return cachedName
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT name FROM Player WHERE id = " + str(playerId))
-        hitname = cursor.fetchone()
-        if (hitname is not None  and  len(hitname) > 0):
-            return hitname[0]
+        name = _storage().playerName(cursor, playerId)
+        if (name is not None):
+            _g_playerCache.add(playerId, name)
+            return name
     except Exception as e:
         app.logger.error("Caught exception in _playerIdToName for '" + str(playerId) + "':  " + str(e))
     return "Unknown"
 
 
+## Time ranges limit stats and recent to a period.  In commands they're given as extra arguments:
+##     days:N               the last N days
+##     thisMonth            since the start of the current month
+##     from:YYYY-MM-DD      from the start of that day
+##     to:YYYY-MM-DD        through the end of that day
+## A range is (start, end) datetimes, either of which may be None (unbounded); end is exclusive.
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"      ## How timestamps are written, and compared as text by SQLite.
+
+def _splitTimeRange(commandArgs):
+    otherArgs = []
+    start = None
+    end = None
+    found = False
+    for arg in commandArgs:
+        try:
+            if (arg.startswith("days:")):
+                start = datetime.datetime.now() - datetime.timedelta(days=int(arg[5:]))
+            elif (arg == "thisMonth"):
+                start = datetime.datetime.combine(datetime.date.today().replace(day=1), datetime.time())
+            elif (arg.startswith("from:")):
+                start = datetime.datetime.strptime(arg[5:], "%Y-%m-%d")
+            elif (arg.startswith("to:")):
+                end = datetime.datetime.strptime(arg[3:], "%Y-%m-%d") + datetime.timedelta(days=1)
+            else:
+                otherArgs.append(arg)
+                continue
+        except ValueError:
+            raise ValueError("Invalid time range '" + arg + "'.  Use days:N, thisMonth, from:YYYY-MM-DD or to:YYYY-MM-DD.")
+        found = True
+    return (otherArgs, (start, end) if (found) else None)
+
+
+## Returns (condition, args) for a time range on column.
+def _timeRangeCondition(timeRange, column):
+    conditions = []
+    args = []
+    if (timeRange[0] is not None):
+        conditions.append(column + " >= %s")
+        args.append(timeRange[0].strftime(_TIMESTAMP_FORMAT))
+    if (timeRange[1] is not None):
+        conditions.append(column + " < %s")
+        args.append(timeRange[1].strftime(_TIMESTAMP_FORMAT))
+    return ("  AND  ".join(conditions) if (len(conditions) > 0) else "1 = 1", args)
+
+
+## Since the start of yesterday:  the default for recent and trash talk.
+def _sinceYesterday():
+    return (datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=1), datetime.time()), None)
+
+
+## Web routes take the range as days=N, period=month, from=YYYY-MM-DD and to=YYYY-MM-DD parameters.
+def _addTimeRangeArgsFromFlaskRequest(commandArgs):
+    if ("days" in request.values):
+        commandArgs.append("days:" + request.values["days"])
+    if (request.values.get("period") == "month"):
+        commandArgs.append("thisMonth")
+    for param in ("from", "to"):
+        if (param in request.values):
+            commandArgs.append(param + ":" + request.values[param])
+
+
 def _addCommandArgsFromFlaskRequest(params, commandArgs):
     if (request.method == "POST"):
         for param in params:
@@ -304,14 +2088,16 @@ def _newPlayer(commandArgs, db, user):
         abort(401)
     if (_checkPlayer(db, playerName)):
         return "User already exists." 
-    sql = "INSERT INTO Player (name) VALUES ('" + str(playerName) + "')"
     cursor = db.cursor()
     try:
-        cursor.execute(sql)
+        playerId = _storage().addPlayer(cursor, playerName)
+        _bumpPlayerVersion(cursor)
         db.commit()
+        _g_playerCache.add(playerId, playerName)
+        _invalidateResponses()
     except Exception as e:
         db.rollback()
-        app.logger.error("Caught exception trying to add new player ('" + str(playerName) + "'):  " + str(e))
+        app.logger.error("Caught exception trying to add new player ('" + playerName + "'):  " + str(e))
         return "Adding player failed."
     _postSlackMessage(user + " added new player:  " + playerName)
     return "Added player "+ playerName + "."
@@ -329,14 +2115,16 @@ def _changePlayer(commandArgs, db, user):
     currentId = _playerId(db, playerName)
     if (-1 == currentId):
         return "User not found." 
-    sql = "UPDATE Player SET name='" + targetName + "' WHERE id=" + str(currentId)
     cursor = db.cursor()
     try:
-        cursor.execute(sql)
+        _storage().renamePlayer(cursor, currentId, targetName)
+        _bumpPlayerVersion(cursor)
         db.commit()
+        _g_playerCache.rename(currentId, targetName)
+        _invalidateResponses()
     except Exception as e:
         db.rollback()
-        app.logger.error("Caught exception trying to change player name from '" + str(playerName) + "' to '" + str(targetName) + "':  " + str(e))
+        app.logger.error("Caught exception trying to change player name from '" + playerName + "' to '" + targetName + "':  " + str(e))
         return "Changing player name failed."
     _postSlackMessage(user + " changed player name '" + playerName + "' to '" + targetName + "'.")
     return "Changed player '" + playerName + "' to '" + targetName + "'."
@@ -348,33 +2136,47 @@ def _getPlayers(commandArgs, db, user):
     players = []
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT name FROM Player")
-        for row in cursor.fetchall():
-            players.append(str(row[0]))
+        for row in _storage().allPlayers(cursor):
+            players.append(row[1])
     except Exception as e:
         app.logger.error("Caught exception trying to retrieve all user names:  " + str(e))
         return "Error!"
     return jsonify({ "players" : players })
 
 
+## The summary tables cover all time; a time-limited request tallies just the games in range (an indexed scan).
+def _loadStats(db, stats, timeRange):
+    if (timeRange is None):
+        return _loadSummary(db, stats)
+    if (len(stats) == 1):
+        return stats[0].tally(db, timeRange)
+    return _tallyAllPlayers(stats, db, timeRange)
+
+
 def _stats(commandArgs, db, user, client = "slack"):
+    try:
+        (commandArgs, timeRange) = _splitTimeRange(commandArgs)
+    except ValueError as e:
+        return str(e)
+    if (len(commandArgs) in (2, 3)  and  "+" in commandArgs[1]):
+        return _teamStats(commandArgs, db, timeRange, client)
     if (len(commandArgs) > 3):
         return "stats comand takes at most two arguments.  Use \"/foosball help\"."
     elif (len(commandArgs) == 1):
-        stats = []
+        snapshot = _currentSnapshot(db) if (timeRange is None) else None
+        stats = [] if (snapshot is None) else snapshot.allStats()
         cursor = db.cursor()
         try:
-            cursor.execute("SELECT name FROM Player")
-            for row in cursor.fetchall():
-                stats.append(PlayerStats(row[0]))
+            if (snapshot is None):
+                for row in _storage().allPlayers(cursor):
+                    stats.append(PlayerStats(row[1], int(row[0])))
         except Exception as e:
             app.logger.error("Caught exception trying to retrieve all user names:  " + str(e))
             return "Error!"
         if (len(stats) == 0):
             return "no games."
-        for ps in stats:
-            ps.tally('red', 'black', db)
-            ps.tally('black', 'red', db)
+        if (snapshot is None  and  not _loadStats(db, stats, timeRange)):
+            return "Error!"
         if (client == "slack"):
             result = ""
             for cat in (("", ""), ("with", ""), ("as", "red"), ("as", "black")):
@@ -393,9 +2195,12 @@ def _stats(commandArgs, db, user, client = "slack"):
         playerName = commandArgs[1]
         if (not _checkPlayer(db, playerName)):
             return "Unknown player."
-        ps = PlayerStats(playerName)
-        ps.tally('red', 'black', db)
-        ps.tally('black', 'red', db)
+        ps = PlayerStats(playerName, _playerId(db, playerName))
+        snapshot = _currentSnapshot(db) if (timeRange is None) else None
+        if (snapshot is not None):
+            snapshot.loadPlayer(ps)
+        elif (not _loadStats(db, [ ps ], timeRange)):
+            return "Error!"
         if (client == "slack"):
             result = ""
             for cat in (("", ""), ("with", ""), ("as", "red"), ("as", "black")):
@@ -410,10 +2215,17 @@ def _stats(commandArgs, db, user, client = "slack"):
         playerName2 = commandArgs[2]
         if (not _checkPlayer(db, playerName2)):
             return "Unknown player 2."
-        ps = PlayerStats(playerName1)
-        ps.tally('red', 'black', db)
-        ps.tally('black', 'red', db)
+        ps = PlayerStats(playerName1, _playerId(db, playerName1))
         player2Id = str(_playerId(db, playerName2))
+        snapshot = _currentSnapshot(db) if (timeRange is None) else None
+        if (timeRange is not None):
+            loaded = ps.tally(db, timeRange, player2Id)
+        elif (snapshot is not None):
+            loaded = snapshot.loadPair(ps, player2Id)
+        else:
+            loaded = _loadPairSummary(db, ps, player2Id)
+        if (not loaded):
+            return "Error!"
         if (client == "slack"):
             result = ps.typeToString("against", player2Id, True)
             result += ps.typeToString("with", player2Id, True)
@@ -424,6 +2236,93 @@ def _stats(commandArgs, db, user, client = "slack"):
     return "Invalid stats comand.  Use \"/foosball help\"."
 
 
+## Parses "name1+name2" into a TeamStats; None if either player is unknown or they are the same player.
+def _parseTeam(db, txt):
+    names = txt.split("+")
+    if (len(names) != 2):
+        return None
+    playerIds = [ _playerId(db, name) for name in names ]
+    if (-1 in playerIds  or  playerIds[0] == playerIds[1]):
+        return None
+    order = [ 0, 1 ] if (playerIds[0] < playerIds[1]) else [ 1, 0 ]
+    return TeamStats([ names[i] for i in order ], [ int(playerIds[i]) for i in order ])
+
+
+## stats name1+name2 [opponent], where the opponent is another team or a single player.
+def _teamStats(commandArgs, db, timeRange, client):
+    team = _parseTeam(db, commandArgs[1])
+    if (team is None):
+        return "Unknown team.  Teams are two different players:  [playerName1]+[playerName2]."
+    if (len(commandArgs) == 2):
+        if (not _loadTeam(db, team, timeRange)):
+            return "Error!"
+        if (client == "slack"):
+            result = ""
+            for category in team.categories():
+                result += team.typeToString(category)
+            return result
+        else:
+            return jsonify({ "team" : team.names, "stats" : [ team.typeToDictionary(category) for category in team.categories() ] })
+    if ("+" in commandArgs[2]):
+        opponent = _parseTeam(db, commandArgs[2])
+        if (opponent is None):
+            return "Unknown opposing team."
+        (opponentIds, opponentNames) = (opponent.playerIds, opponent.names)
+    else:
+        opponentId = _playerId(db, commandArgs[2])
+        if (opponentId == -1):
+            return "Unknown opposing player."
+        (opponentIds, opponentNames) = ([ opponentId, opponentId ], [ commandArgs[2] ])
+    category = "against " + "+".join(opponentNames)
+    if (not _loadTeam(db, team, timeRange, opponentIds, category)):
+        return "Error!"
+    if (client == "slack"):
+        return team.typeToString(category)
+    else:
+        return jsonify({ "team" : team.names, "otherTeam" : opponentNames, "pairStats" : [ team.typeToDictionary(category) ] })
+
+
+## Team leaderboard by win percentage:  teams [N] [time range].  Slack shows the top N (default 10).
+def _teams(commandArgs, db, user, client = "slack"):
+    try:
+        (commandArgs, timeRange) = _splitTimeRange(commandArgs)
+    except ValueError as e:
+        return str(e)
+    if (len(commandArgs) > 2  or  (len(commandArgs) == 2  and  not commandArgs[1].isdigit())):
+        return "teams command takes an optional number of teams to show and a time range.  Use \"/foosball help\"."
+    count = int(commandArgs[1]) if (len(commandArgs) == 2) else 10
+    teams = []
+    cursor = db.cursor()
+    try:
+        if (timeRange is None):
+            cursor.execute("SELECT player1Id, player2Id, gamesPlayed, wins, losses, ties, goalDelta FROM TeamSummary WHERE defenseId = 0")
+            totals = [ ((int(row[0]), int(row[1])), row[2:]) for row in cursor.fetchall() ]
+        else:
+            (condition, args) = _timeRangeCondition(timeRange, "timestamp")
+            cursor.execute("SELECT redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense FROM Game " \
+                           "WHERE (redOffense <> redDefense  OR  blackOffense <> blackDefense)  AND  " + condition, args)
+            teamTotals = {}
+            _tallyTeams(cursor.fetchall(), teamTotals, {})
+            totals = [ (key[:2], counters) for (key, counters) in teamTotals.items() if (key[2] == 0) ]
+    except Exception as e:
+        app.logger.error("Caught exception trying to retrieve team stats:  " + str(e))
+        return "Error!"
+    for (playerIds, counters) in totals:
+        team = TeamStats([ _playerIdToName(db, playerId) for playerId in playerIds ], list(playerIds))
+        team.addTotals("overall", *counters)
+        teams.append(team)
+    teams.sort(key=lambda team: (float(team.totals["overall"][_FIELD_WIN]) / team.totals["overall"][_FIELD_PLAYED], team.totals["overall"][_FIELD_PLAYED]), reverse=True)
+    if (client == "slack"):
+        if (len(teams) == 0):
+            return "no team games."
+        result = PlayerStats.header("team")
+        for team in teams[:count]:
+            result += team.typeToString("overall", False)
+        return result
+    else:
+        return jsonify({ "teams" : [ dict(team.typeToDictionary("overall"), team=team.names) for team in teams ] })
+
+
 class GameSide(object):
     def __init__(self, txt, color="", defense="", offense="", score=-1):
         if (txt is not None  and  len(txt) > 0):
@@ -467,9 +2366,28 @@ class GameSide(object):
         return False
 
 
+## Orders two parsed sides and their players' ids ((defense, offense) for each) by color, returning
+## (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense).
+def _gameRow(firstSide, secondSide, firstIds, secondIds):
+    if (firstSide.p1pos.startswith("red")):
+        (redSide, redIds, blackSide, blackIds) = (firstSide, firstIds, secondSide, secondIds)
+    else:
+        (redSide, redIds, blackSide, blackIds) = (secondSide, secondIds, firstSide, firstIds)
+    return (int(redSide.score), int(blackSide.score), redIds[1], redIds[0], blackIds[1], blackIds[0])
+
+
+## Everything derived from newly inserted games (a list of (gameId, timestamp, row) in id order); caller commits.
+def _recordGameTallies(cursor, games):
+    participants = []
+    for (gameId, timestamp, row) in games:
+        participants.extend(_participantRows(gameId, timestamp, row[2], row[3], row[4], row[5]))
+    _insertParticipants(cursor, participants)
+    _updateSummary(cursor, [ row for (gameId, timestamp, row) in games ])
+    _updateTeamSummary(cursor, [ row for (gameId, timestamp, row) in games ])
+    _updateRatings(cursor, [ (gameId, row) for (gameId, timestamp, row) in games ])
+
+
 def _game(commandArgs, db, user):
-    if (not _sqlOk(user)):
-        abort(401)
     if (len(commandArgs) != 3):
         return "game comand takes two arguments.  Use \"/foosball help\"."
     firstSide = GameSide(commandArgs[1])
@@ -485,34 +2403,15 @@ def _game(commandArgs, db, user):
     if (s1p1id == -1  or  s2p2id == -1):
         return "Unknown player on second team.\n"
     cursor = db.cursor()
-    sql = "INSERT INTO Game (timestamp, recordedBy, redScore, blackScore, redDefense, redOffense, blackDefense, blackOffense) VALUES ("
-    sql += "'" + datetime.datetime.now().strftime("%Y-%m-%d %H-%M-%S") + "'"
-    sql += ",'" + user + "'"
-    redMargin = 0
-    if (firstSide.p1pos.startswith("red")):
-        sql += "," + str(firstSide.score)
-        sql += "," + str(secondSide.score)
-        redMargin = int(firstSide.score) - int(secondSide.score)
-        redDefense = s1p1id
-        redOffense = s1p2id
-        blackDefense = s2p1id
-        blackOffense = s2p2id
-    else:
-        sql += "," + str(secondSide.score)
-        sql += "," + str(firstSide.score)
-        redMargin = int(secondSide.score) - int(firstSide.score)
-        redDefense = s2p1id
-        redOffense = s2p2id
-        blackDefense = s1p1id
-        blackOffense = s1p2id
-    sql += "," + str(redDefense)
-    sql += "," + str(redOffense)
-    sql += "," + str(blackDefense)
-    sql += "," + str(blackOffense)
-    sql += ")"
-    try:
-        cursor.execute(sql)
+    timestamp = datetime.datetime.now().strftime(_TIMESTAMP_FORMAT)
+    gameRow = _gameRow(firstSide, secondSide, (s1p1id, s1p2id), (s2p1id, s2p2id))
+    (redScore, blackScore, redOffense, redDefense, blackOffense, blackDefense) = gameRow
+    redMargin = redScore - blackScore
+    try:
+        gameId = _storage().insertGame(cursor, timestamp, user, gameRow)
+        _recordGameTallies(cursor, [ (gameId, timestamp, gameRow) ])
         db.commit()
+        _invalidateResponses()
     except Exception as e:
         db.rollback()
         app.logger.error("Caught exception trying to insert into Game table:  " + str(e))
@@ -526,20 +2425,136 @@ def _game(commandArgs, db, user):
     return "Game recorded."
 
 
+## Bulk import:  one game per line, either CSV (side1,side2[,timestamp]) or NDJSON ({"side1": ..., "side2": ...[, "timestamp": ...]}),
+## with sides in the same notation as the game command.  Nothing is recorded unless every line is valid.
+
+_BULK_TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H-%M-%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+def _parseBulkLine(line, fmt):
+    if (fmt == "csv"):
+        if (str is bytes):                                  ## Python 2's csv module only reads bytes.
+            fields = [ field.decode("utf-8") for field in next(csv.reader([ line.encode("utf-8") ])) ]
+        else:
+            fields = next(csv.reader([ line ]))
+        if (len(fields) < 2  or  len(fields) > 3):
+            raise ValueError("expected side1,side2[,timestamp]")
+        if (fields[0].strip() == "side1"):
+            return None                                     ## header
+        return [ f.strip() for f in fields ] + ([ "" ] if (len(fields) == 2) else [])
+    game = json.loads(line)
+    if (not isinstance(game, dict)  or  "side1" not in game  or  "side2" not in game):
+        raise ValueError("expected an object with side1 and side2")
+    return [ game["side1"], game["side2"], game.get("timestamp", "") ]
+
+
+def _bulkTimestamp(txt, now):
+    if (txt is None  or  len(txt) == 0):
+        return now
+    for fmt in _BULK_TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(txt, fmt).strftime(_TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError("invalid timestamp '" + txt + "'")
+
+
+## Cache first, then one query for all the misses.
+def _resolvePlayerIds(db, names):
+    ids = {}
+    misses = []
+    for name in names:
+        cachedId = _g_playerCache.playerId(db, name)
+        if (cachedId is not None):
+            ids[name] = cachedId
+        else:
+            misses.append(name)
+    if (len(misses) > 0):
+        missesByLower = dict((name.lower(), name) for name in misses)
+        for row in _storage().findPlayers(db.cursor(), misses):
+            lookupName = missesByLower.get(row[1].lower())
+            if (lookupName is not None):
+                _g_playerCache.add(row[0], row[1], lookupName)
+                ids[lookupName] = int(row[0])
+    return ids
+
+
+## Returns (HTTP status, result dictionary).
+def _bulkGames(lines, fmt, db, user):
+    now = datetime.datetime.now().strftime(_TIMESTAMP_FORMAT)
+    errors = []
+    parsed = []
+    names = set()
+    lineNumber = 0
+    for line in lines:
+        lineNumber += 1
+        if (not isinstance(line, type(u""))):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if (len(line) == 0):
+            continue
+        try:
+            fields = _parseBulkLine(line, fmt)
+            if (fields is None):
+                continue
+            firstSide = GameSide(fields[0])
+            secondSide = GameSide(fields[1])
+            if (not firstSide.valid  or  not secondSide.valid):
+                raise ValueError("invalid sides")
+            timestamp = _bulkTimestamp(fields[2], now)
+            sides = []
+            for side in (firstSide, secondSide):
+                players = (side.p1, side.p1 if (side.p2 is None) else side.p2)
+                names.update(players)
+                sides.append(players)
+        except (ValueError, TypeError, AttributeError, csv.Error) as e:
+            errors.append({ "line": lineNumber, "error": str(e) })
+            continue
+        parsed.append((lineNumber, timestamp, firstSide, secondSide, sides))
+    ids = _resolvePlayerIds(db, names)
+    games = []
+    for (lineNumber, timestamp, firstSide, secondSide, sides) in parsed:
+        unknown = [ name for players in sides for name in players if (name not in ids) ]
+        if (len(unknown) > 0):
+            errors.append({ "line": lineNumber, "error": "unknown player '" + unknown[0] + "'" })
+            continue
+        firstIds = tuple(ids[name] for name in sides[0])
+        secondIds = tuple(ids[name] for name in sides[1])
+        games.append((timestamp, _gameRow(firstSide, secondSide, firstIds, secondIds)))
+    if (len(errors) > 0):
+        errors.sort(key=lambda error: error["line"])
+        return (400, { "recorded": 0, "errors": errors })
+    if (len(games) == 0):
+        return (200, { "recorded": 0, "errors": [] })
+    cursor = db.cursor()
+    try:
+        _recordGameTallies(cursor, _storage().insertGames(cursor, games, user))
+        db.commit()
+        _invalidateResponses()
+    except Exception as e:
+        db.rollback()
+        app.logger.error("Caught exception trying to bulk insert into Game table:  " + str(e))
+        return (500, { "recorded": 0, "errors": [ { "line": None, "error": "Games NOT recorded.  Something went wrong." } ] })
+    _postSlackMessage(user + " imported " + str(len(games)) + " game" + ("" if (len(games) == 1) else "s") + ".")
+    return (200, { "recorded": len(games), "errors": [] })
+
+
 
 def _recent(commandArgs, db, user, client = "slack"):
+    try:
+        (commandArgs, timeRange) = _splitTimeRange(commandArgs)
+    except ValueError as e:
+        return str(e)
     if (len(commandArgs) != 1):
-        return "recent comand takes no arguments.  Use \"/foosball help\"."
+        return "recent comand takes no arguments other than a time range.  Use \"/foosball help\"."
     cursor = db.cursor()
     try:
         rows = []
-        cursor.execute("SELECT * FROM Game as G WHERE timestamp > DATE_SUB(CURDATE(), INTERVAL 1 DAY) ORDER BY timestamp DESC")
         maxSideLen = 7
         maxAddedByLen = 7
-        for row in cursor.fetchall():
+        for row in _storage().recentGames(cursor, timeRange if (timeRange is not None) else _sinceYesterday()):
             rows.append({ "gameid" : row[0], "timestamp" : row[1], "addedBy" : row[2], \
-                          "side1" :  { "color" : "red", "defense" : _playerIdToName(db, row[5]), "offense" : _playerIdToName(db, row[6]), "score" : row[3] }, \
-                          "side2" :  { "color" : "black", "defense" : _playerIdToName(db, row[7]), "offense" : _playerIdToName(db, row[8]), "score" : row[4] } })
+                          "side1" :  { "color" : "red", "defense" : row[5], "offense" : row[6], "score" : row[3] }, \
+                          "side2" :  { "color" : "black", "defense" : row[7], "offense" : row[8], "score" : row[4] } })
             if (len(row[2]) > maxAddedByLen):
                 maxAddedByLen = len(row[2])
             if (len(rows[-1]['side1']) > maxSideLen):
@@ -565,14 +2580,146 @@ def _recent(commandArgs, db, user, client = "slack"):
     return "Error!"
 
 
+## Game history export.  Rows are read through an unbuffered cursor and written out as they arrive, so memory stays flat
+## however long the history is.  Pages are keyed on Game.id:  pass the last gameid seen as "after" to get the next one.
+
+_EXPORT_CSV_HEADER = [ "gameid", "timestamp", "addedBy", "redDefense", "redOffense", "redScore", "blackDefense", "blackOffense", "blackScore" ]
+_EXPORT_FETCH_SIZE = 1000
+
+class _LineBuffer(object):
+    def write(self, txt):
+        self.line = txt
+
+
+def _csvLine(fields):
+    buf = _LineBuffer()
+    if (str is bytes):                                      ## Python 2's csv module only writes bytes.
+        csv.writer(buf, lineterminator="\n").writerow([ f.encode("utf-8") if (isinstance(f, type(u""))) else f for f in fields ])
+        return buf.line.decode("utf-8")
+    csv.writer(buf, lineterminator="\n").writerow(fields)
+    return buf.line
+
+
+## Returns (query, args).
+def _exportQuery(timeRange, after, limit):
+    query = "SELECT G.id, G.timestamp, G.recordedBy, G.redScore, G.blackScore, RD.name, RO.name, BD.name, BO.name FROM Game AS G "
+    query += "JOIN Player AS RD ON RD.id = G.redDefense JOIN Player AS RO ON RO.id = G.redOffense "
+    query += "JOIN Player AS BD ON BD.id = G.blackDefense JOIN Player AS BO ON BO.id = G.blackOffense "
+    query += "WHERE G.id > %s"
+    args = [ int(after) ]
+    if (timeRange is not None):
+        (condition, rangeArgs) = _timeRangeCondition(timeRange, "G.timestamp")
+        query += "  AND  " + condition
+        args.extend(rangeArgs)
+    query += " ORDER BY G.id"
+    if (limit is not None):
+        query += " LIMIT %s"
+        args.append(int(limit))
+    return (query, args)
+
+
+## Generator owning its own connection:  the response body is produced after the route has returned.
+def _exportGames(fmt, timeRange, after, limit):
+    db = _connectDB()
+    cursor = None
+    try:
+        cursor = _storage().streamingCursor(db)
+        cursor.execute(*_exportQuery(timeRange, after, limit))
+        if (fmt == "csv"):
+            yield _csvLine(_EXPORT_CSV_HEADER)
+        while True:
+            rows = cursor.fetchmany(_EXPORT_FETCH_SIZE)
+            if (not rows):
+                break
+            for row in rows:
+                if (fmt == "csv"):
+                    yield _csvLine([ row[0], str(row[1]), row[2], row[5], row[6], row[3], row[7], row[8], row[4] ])
+                else:
+                    yield json.dumps({ "gameid" : row[0], "timestamp" : str(row[1]), "addedBy" : row[2], \
+                                       "side1" : { "color" : "red", "defense" : row[5], "offense" : row[6], "score" : row[3] }, \
+                                       "side2" : { "color" : "black", "defense" : row[7], "offense" : row[8], "score" : row[4] } }) + "\n"
+    except Exception as e:
+        app.logger.error("Caught exception exporting games:  " + str(e))
+    finally:
+        if (cursor is not None):
+            cursor.close()
+        db.close()
+
+
+def _rebuildStats(commandArgs, db, user):
+    if (len(commandArgs) != 1):
+        return "rebuildStats command takes no arguments.  Use \"/foosball help\"."
+    if (not _rebuildParticipants(db)):
+        return "Rebuilding game participants failed."
+    if (not _rebuildSummary(db)):
+        return "Rebuilding stats failed."
+    if (not _rebuildTeamSummary(db)):
+        return "Rebuilding team stats failed."
+    if (not _rebuildRatings(db)):
+        return "Rebuilding ratings failed."
+    _invalidateResponses()
+    _markSnapshotStale()
+    return "Stats rebuilt."
+
+
+## Head-to-head grid from PairSummary:  for each pair of players who have met, their games with and against each other.
+## commandArgs after the command name limit it to those players.
+def _matrix(commandArgs, db, user):
+    playerIds = []
+    for playerName in commandArgs[1:]:
+        playerId = _playerId(db, playerName)
+        if (playerId == -1):
+            return "Unknown player '" + playerName + "'."
+        playerIds.append(int(playerId))
+    query = "SELECT P.name, O.name, S.rel, S.gamesPlayed, S.wins, S.losses, S.ties, S.goalDelta FROM PairSummary AS S " \
+            "JOIN Player AS P ON P.id = S.playerId JOIN Player AS O ON O.id = S.otherId"
+    if (len(playerIds) > 0):
+        idList = ", ".join([ "%s" ] * len(playerIds))
+        query += " WHERE S.playerId IN (" + idList + ")  AND  S.otherId IN (" + idList + ")"
+    matrix = {}
+    cursor = db.cursor()
+    try:
+        cursor.execute(query, playerIds + playerIds)
+        for row in cursor.fetchall():
+            cell = matrix.setdefault(row[0], {}).setdefault(row[1], {})
+            cell[row[2]] = { "gamesPlayed" : int(row[3]), "wins" : int(row[4]), "losses" : int(row[5]), "ties" : int(row[6]), "goalDifferential" : int(row[7]) }
+    except Exception as e:
+        app.logger.error("Caught exception trying to retrieve the head-to-head matrix:  " + str(e))
+        return "Error!"
+    players = commandArgs[1:] if (len(playerIds) > 0) else sorted(matrix.keys())
+    return jsonify({ "players" : players, "matrix" : matrix })
+
+
+def _ratings(commandArgs, db, user, client = "slack"):
+    if (len(commandArgs) != 1):
+        return "ratings command takes no arguments.  Use \"/foosball help\"."
+    leaders = []
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT P.name, R.rating, R.gamesRated FROM Rating AS R JOIN Player AS P ON P.id = R.playerId ORDER BY R.rating DESC")
+        for row in cursor.fetchall():
+            leaders.append({ "player" : row[0], "rating" : round(float(row[1]), 1), "gamesRated" : int(row[2]) })
+    except Exception as e:
+        app.logger.error("Caught exception trying to retrieve ratings:  " + str(e))
+        return "Error!"
+    if (client == "slack"):
+        if (len(leaders) == 0):
+            return "no games."
+        result = "   rank   rating   games\n"
+        for (rank, leader) in enumerate(leaders):
+            result += "%s:\t%d\t%6.1f\t%d\n" % (leader["player"], rank + 1, leader["rating"], leader["gamesRated"])
+        return result
+    else:
+        return jsonify({ "ratings" : leaders })
+
+
 def _trash(commandArgs, db, user):
     result = "You're not good enough yet to trash talk!"
     if (len(commandArgs) != 1):
         return result
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT * FROM Game as G WHERE timestamp > DATE_SUB(CURDATE(), INTERVAL 1 DAY) ORDER BY timestamp DESC LIMIT 1")
-        lastgame = cursor.fetchone()
+        lastgame = _storage().lastGame(cursor, _sinceYesterday())
         if (lastgame is None  or  len(lastgame) == 0):
             return result
         winner = -1
@@ -595,15 +2742,356 @@ def _trash(commandArgs, db, user):
 
 
 
+def _slackCommand(commandArgs, db, user):
+    command = commandArgs[0]
+    if (command == u"stats"):
+        return _coalesced("slack", commandArgs, lambda: _stats(commandArgs, db, user))
+    elif (command == u"recent"):
+        return _recent(commandArgs, db, user)
+    elif (command == u"game"):
+        return _game(commandArgs, db, user)
+    elif (command == u"newPlayer"):
+        return _newPlayer(commandArgs, db, user)
+    elif (command == u"changePlayer"):
+        return _changePlayer(commandArgs, db, user)
+    elif (command == u"ratings"):
+        return _ratings(commandArgs, db, user)
+    elif (command == u"teams"):
+        return _teams(commandArgs, db, user)
+    elif (command == u"rebuildStats"):
+        return _rebuildStats(commandArgs, db, user)
+    elif (command == u"trash"):
+        return _trash(commandArgs, db, user)
+    else:
+        return "Invalid command.  Use \"/foosball help\"."
+
+
+_METRIC_COMMANDS = ("stats", "teams", "recent", "game", "newPlayer", "changePlayer", "ratings", "rebuildStats", "trash")
+
+def _runSlackCommand(commandArgs, user):
+    start = time.time()
+    trace = _currentTrace()
+    ownTrace = (trace is None)         ## Deferred commands run on a worker thread, outside any request.
+    if (ownTrace):
+        trace = _beginTrace()
+    (queriesBefore, dbBefore) = (trace.queries, trace.stages.get("db", 0.0))
+    db = _connectDB()
+    try:
+        return _slackCommand(commandArgs, db, user)
+    except Exception as e:
+        app.logger.error("Caught exception in slack():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+        seconds = time.time() - start
+        _recordCommandTime(commandArgs, seconds)
+        command = commandArgs[0] if (commandArgs[0] in _METRIC_COMMANDS) else "other"
+        _g_metrics.observe("foosball_slack_command_seconds", seconds, command=command)
+        _g_metrics.increment("foosball_slack_command_db_queries_total", trace.queries - queriesBefore, command=command)
+        _g_metrics.increment("foosball_slack_command_db_seconds_total", trace.stages.get("db", 0.0) - dbBefore, command=command)
+        trace.add("command " + command, seconds)
+        if (ownTrace):
+            _endTrace()
+            _logIfSlow("deferred " + command, seconds, trace)
+
+
+
+#######################
+## Deferred Commands ##
+#######################
+
+## Slack wants an answer to a slash command within 3 seconds.  Commands listed in slack.deferredCommands, or whose
+## recent running time (a moving average per command and argument count) exceeds slack.deferThreshold seconds, are
+## acknowledged right away; the result is computed on a worker thread and POSTed to the request's response_url.
+
+class WorkerPool(object):
+    def __init__(self, numWorkers = 4, maxPending = 100):
+        self.numWorkers = numWorkers
+        self.jobs = queue.Queue(maxPending)
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            (fn, args) = self.jobs.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                app.logger.error("Caught exception in worker thread:  " + str(e))
+
+    ## Returns False if the backlog is full.
+    def submit(self, fn, *args):
+        with self.lock:
+            if (len(self.threads) == 0):
+                for i in range(self.numWorkers):
+                    thread = threading.Thread(target=self._run, name="DeferredWorker-" + str(i))
+                    thread.daemon = True
+                    thread.start()
+                    self.threads.append(thread)
+        try:
+            self.jobs.put_nowait((fn, args))
+        except queue.Full:
+            return False
+        return True
+
+
+_g_workers = None
+_g_workersLock = threading.Lock()
+_g_commandTimes = {}
+_g_commandTimesLock = threading.Lock()
+_g_responseSession = requests.Session()
+
+
+def _deferredWorkers():
+    global _g_config
+    global _g_workers
+    with _g_workersLock:
+        if (_g_workers is None):
+            _g_workers = WorkerPool(int(_g_config["slack"].get("deferredWorkers", 4)))
+        return _g_workers
+
+
+def _commandKey(commandArgs):
+    return commandArgs[0] + "/" + str(len(commandArgs))
+
+
+def _recordCommandTime(commandArgs, seconds):
+    key = _commandKey(commandArgs)
+    with _g_commandTimesLock:
+        previous = _g_commandTimes.get(key)
+        _g_commandTimes[key] = seconds if (previous is None) else (0.7 * previous + 0.3 * seconds)
+
+
+def _shouldDefer(commandArgs):
+    global _g_config
+    if (commandArgs[0] in _g_config["slack"].get("deferredCommands", [])):
+        return True
+    with _g_commandTimesLock:
+        expected = _g_commandTimes.get(_commandKey(commandArgs))
+    return (expected is not None  and  expected > float(_g_config["slack"].get("deferThreshold", 1.5)))
+
+
+def _runDeferredSlackCommand(commandArgs, user, responseURL):
+    with app.app_context():
+        result = _runSlackCommand(commandArgs, user)
+    try:
+        r = _g_responseSession.post(responseURL, json={ "response_type" : "ephemeral", "text" : result }, timeout=10)
+        if (r.status_code >= 300):
+            app.logger.warning("Posting deferred response to slack failed:  " + r.text)
+    except Exception as e:
+        app.logger.warning("Posting deferred response to slack failed:  " + str(e))
+
+
+
+####################
+## Response Cache ##
+####################
+
+## Web responses of /stats, /recent, /players, /matrix and /teams, cached per worker by route and arguments.  Each entry
+## is tagged with the data version (latest Game.id and the Metadata playerVersion), which every request reads first, so
+## writes made through other workers are noticed as well.  Sliding windows (days:N, thisMonth, and /recent's default
+## last day) are also tagged with the current minute.
+
+class ResponseCache(object):
+    def __init__(self, maxEntries = 256):
+        self.lock = threading.Lock()
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None  or  entry[0] != version):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            while (len(self.entries) > self.maxEntries):
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def statistics(self):
+        with self.lock:
+            return { "entries" : len(self.entries), "hits" : self.hits, "misses" : self.misses, "invalidations" : self.invalidations }
+
+
+_g_responseCache = None
+_g_responseCacheLock = threading.Lock()
+_g_writeGeneration = 0                  ## Bumped by local writes; keeps new requests off computations started before them.
+
+
+def _responseCache():
+    global _g_config
+    global _g_responseCache
+    with _g_responseCacheLock:
+        if (_g_responseCache is None):
+            _g_responseCache = ResponseCache(int(_g_config.get("responseCacheSize", 256)))
+        return _g_responseCache
+
+
+## Called after a write is committed.
+def _invalidateResponses():
+    global _g_writeGeneration
+    _g_writeGeneration += 1
+    if (_g_responseCache is not None):
+        _g_responseCache.invalidate()
+
+
+## Caller commits.
+def _bumpPlayerVersion(cursor):
+    cursor.execute(_storage().upsert("Metadata", ("name",), ("value",), True), ("playerVersion", 1))
+
+
+def _dataVersion(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT (SELECT COALESCE(MAX(id), 0) FROM Game), (SELECT COALESCE(MAX(value), 0) FROM Metadata WHERE name = %s)", ("playerVersion",))
+    row = cursor.fetchone()
+    return (int(row[0]), int(row[1]))
+
+
+def _isSlidingWindow(commandArgs, byDefault):
+    for arg in commandArgs:
+        if (arg.startswith("days:")  or  arg == "thisMonth"):
+            return True
+        if (arg.startswith("from:")  or  arg.startswith("to:")):
+            byDefault = False
+    return byDefault
+
+
+## Answers with a 304 when the client's If-None-Match / If-Modified-Since still holds.  Only successful JSON responses are
+## cached; messages and errors are returned as they are.
+def _cachedResponse(commandArgs, db, compute, slidingWindow = False):
+    try:
+        version = _dataVersion(db)
+    except Exception as e:
+        app.logger.error("Caught exception reading the data version:  " + str(e))
+        return compute()
+    if (slidingWindow):
+        version += (int(time.time() // 60),)
+    key = tuple(commandArgs)
+    entry = _responseCache().get(key, version)
+    if (entry is None):
+        lastModified = int(time.time())
+        result = compute()
+        if (not isinstance(result, Response)  or  result.status_code != 200):
+            return result
+        etag = "-".join(str(v) for v in version) + "-" + hashlib.md5(repr(key).encode("utf-8")).hexdigest()[:16]
+        entry = (version, etag, lastModified, result.get_data(), result.mimetype)
+        _responseCache().put(key, entry)
+    response = Response(entry[3], mimetype=entry[4])
+    response.set_etag(entry[1])
+    response.last_modified = entry[2]
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+########################
+## Request Coalescing ##
+########################
+
+## When a result is posted, many people ask for the same stats at once.  Identical concurrent stats requests in this worker
+## wait for the one already running and share its result instead of each running it against the database.
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.executed = {}
+        self.coalesced = {}
+
+    def run(self, key, name, fn):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = (flight is None)
+            if (leader):
+                flight = _Flight()
+                self.flights[key] = flight
+                self.executed[name] = self.executed.get(name, 0) + 1
+            else:
+                self.coalesced[name] = self.coalesced.get(name, 0) + 1
+        if (not leader):
+            flight.done.wait()
+            if (flight.error is not None):
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def statistics(self):
+        with self.lock:
+            return { "inFlight" : len(self.flights), "executed" : dict(self.executed), "coalesced" : dict(self.coalesced) }
+
+
+_g_singleFlight = SingleFlight()
+
+
+## Responses are shared as (body, status, mimetype) and rebuilt for each caller; strings are shared as they are.
+def _coalesced(client, commandArgs, fn):
+    def compute():
+        result = fn()
+        if (isinstance(result, Response)):
+            return (result.get_data(), result.status_code, result.mimetype)
+        return result
+    result = _g_singleFlight.run((client, _g_writeGeneration) + tuple(commandArgs), commandArgs[0], compute)
+    if (isinstance(result, tuple)):
+        return Response(result[0], status=result[1], mimetype=result[2])
+    return result
+
+
 ############
 ## ROUTES ##
 ############
 
+@app.before_request
+def _beginRequestTrace():
+    _beginTrace()
+
+
+@app.teardown_request
+def _endRequestTrace(exception):
+    trace = _endTrace()
+    if (trace is None):
+        return
+    seconds = time.time() - trace.start
+    route = request.url_rule.rule if (request.url_rule is not None) else "unmatched"
+    _g_metrics.observe("foosball_request_seconds", seconds, route=route, method=request.method)
+    _g_metrics.increment("foosball_request_db_queries_total", trace.queries, route=route)
+    _g_metrics.increment("foosball_request_db_seconds_total", trace.stages.get("db", 0.0), route=route)
+    _logIfSlow(request.method + " " + route, seconds, trace)
+
+
 @app.route("/player", methods=['POST'])             ## Route used by web
 def newPlayer():
     _startup()
     commandArgs = [ "player" ]
-    if (not _addCommandArgsFromFlaskRequest("targetName", commandArgs)):
+    if (not _addCommandArgsFromFlaskRequest([ "targetName" ], commandArgs)):
         abort(400)
     user = "a web user"
     db = _connectDB()
@@ -627,7 +3115,7 @@ def getPlayers():
     user = "a web user"
     db = _connectDB()
     try:
-        return _getPlayers(commandArgs, db, user)
+        return _cachedResponse(commandArgs, db, lambda: _getPlayers(commandArgs, db, user))
     except Exception as e:
         app.logger.error("Caught exception in getPlayers():  " + str(e))
         return "Error!"
@@ -652,16 +3140,40 @@ def game():
         db.close()
 
 
+## The body is streamed line by line:  CSV when format=csv or the Content-Type says so, NDJSON otherwise.
+@app.route("/games/bulk", methods=['POST'])         ## Route used by web
+def bulkGames():
+    _startup()
+    fmt = request.args.get("format")
+    if (fmt is None):
+        fmt = "csv" if ("csv" in (request.content_type or "")) else "ndjson"
+    if (fmt not in ("csv", "ndjson")):
+        abort(400)
+    user = "a web user"
+    db = _connectDB()
+    try:
+        (status, result) = _bulkGames(request.stream, fmt, db, user)
+        response = jsonify(result)
+        response.status_code = status
+        return response
+    except Exception as e:
+        app.logger.error("Caught exception in bulkGames():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+
+
 @app.route("/stats", methods=['GET','POST'])        ## Route used by web
 def stats():
     _startup()
     commandArgs = [ "stats" ]
-    if (not _addCommandArgsFromFlaskRequest("playerName", commandArgs)):
+    if (not _addCommandArgsFromFlaskRequest([ "playerName" ], commandArgs)):
         _addCommandArgsFromFlaskRequest(["playerName1", "playerName2"], commandArgs)
+    _addTimeRangeArgsFromFlaskRequest(commandArgs)
     user = "web"
     db = _connectDB()
     try:
-        return _stats(commandArgs, db, user, "web")
+        return _cachedResponse(commandArgs, db, lambda: _coalesced("web", commandArgs, lambda: _stats(commandArgs, db, user, "web")), _isSlidingWindow(commandArgs, False))
     except Exception as e:
         app.logger.error("Caught exception in stats():  " + str(e))
         return "Error!"
@@ -669,14 +3181,81 @@ def stats():
         db.close()
 
 
+## Optional players=name1,name2,... selects a submatrix.
+@app.route("/matrix", methods=['GET'])              ## Route used by web
+def matrix():
+    _startup()
+    commandArgs = [ "matrix" ]
+    if (len(request.args.get("players", "")) > 0):
+        commandArgs.extend(name.strip() for name in request.args["players"].split(","))
+    user = "a web user"
+    db = _connectDB()
+    try:
+        return _cachedResponse(commandArgs, db, lambda: _matrix(commandArgs, db, user))
+    except Exception as e:
+        app.logger.error("Caught exception in matrix():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+
+
+@app.route("/teams", methods=['GET'])               ## Route used by web
+def teams():
+    _startup()
+    commandArgs = [ "teams" ]
+    _addTimeRangeArgsFromFlaskRequest(commandArgs)
+    user = "a web user"
+    db = _connectDB()
+    try:
+        return _cachedResponse(commandArgs, db, lambda: _teams(commandArgs, db, user, "web"), _isSlidingWindow(commandArgs, False))
+    except Exception as e:
+        app.logger.error("Caught exception in teams():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+
+
+@app.route("/ratings", methods=['GET'])             ## Route used by web
+def ratings():
+    _startup()
+    commandArgs = [ "ratings" ]
+    user = "a web user"
+    db = _connectDB()
+    try:
+        return _ratings(commandArgs, db, user, "web")
+    except Exception as e:
+        app.logger.error("Caught exception in ratings():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+
+
+@app.route("/stats/rebuild", methods=['POST'])       ## Route used by web
+def rebuildStats():
+    _startup()
+    if (not _adminRequestOk()):
+        abort(401)
+    commandArgs = [ "rebuildStats" ]
+    user = "a web user"
+    db = _connectDB()
+    try:
+        return _rebuildStats(commandArgs, db, user)
+    except Exception as e:
+        app.logger.error("Caught exception in rebuildStats():  " + str(e))
+        return "Error!"
+    finally:
+        db.close()
+
+
 @app.route("/recent", methods=['GET','POST'])       ## Route used by web
 def recent():
     _startup()
     commandArgs = [ "recent" ]
+    _addTimeRangeArgsFromFlaskRequest(commandArgs)
     user = "a web user"
     db = _connectDB()
     try:
-        return _recent(commandArgs, db, user, "web")
+        return _cachedResponse(commandArgs, db, lambda: _recent(commandArgs, db, user, "web"), _isSlidingWindow(commandArgs, True))
     except Exception as e:
         app.logger.error("Caught exception in recent():  " + str(e))
         return "Error!"
@@ -684,57 +3263,132 @@ def recent():
         db.close()
 
 
+## NDJSON by default, CSV with format=csv.  Optional after=<gameid>, limit=N and the usual time range parameters.
+@app.route("/games", methods=['GET'])               ## Route used by web
+def games():
+    _startup()
+    commandArgs = [ "games" ]
+    _addTimeRangeArgsFromFlaskRequest(commandArgs)
+    try:
+        (commandArgs, timeRange) = _splitTimeRange(commandArgs)
+        after = int(request.args.get("after", 0))
+        limit = int(request.args["limit"]) if ("limit" in request.args) else None
+    except ValueError:
+        abort(400)
+    fmt = request.args.get("format", "ndjson")
+    if (fmt not in ("csv", "ndjson")  or  after < 0  or  (limit is not None  and  limit <= 0)):
+        abort(400)
+    mimetype = "text/csv" if (fmt == "csv") else "application/x-ndjson"
+    return Response(_exportGames(fmt, timeRange, after, limit), mimetype=mimetype)
+
+
+@app.route("/config/reload", methods=['POST'])      ## Route used by web
+def reloadConfig():
+    _startup()
+    if (not _adminRequestOk()):
+        abort(401)
+    if (not _readConfigFile(True)):
+        return "Config reload failed; keeping the previous config."
+    return "Config reloaded."
+
+
+@app.route("/pool", methods=['GET'])                ## Route used by web
+def pool():
+    _startup()
+    return jsonify(_connectionPool().statistics())
+
+
+@app.route("/cache", methods=['GET'])               ## Route used by web
+def cache():
+    _startup()
+    return jsonify({ "responses" : _responseCache().statistics(), "coalescing" : _g_singleFlight.statistics() })
+
+
+## Pool, Slack queue, cache and coalescing statistics are included as untyped samples.
+@app.route("/metrics", methods=['GET'])             ## Route used by monitoring
+def metrics():
+    _startup()
+    lines = _g_metrics.render()
+    sections = [ ("foosball_pool_", _connectionPool().statistics()), ("foosball_slack_queue_", _slackQueue().statistics()), \
+                 ("foosball_response_cache_", _responseCache().statistics()) ]
+    coalescing = _g_singleFlight.statistics()
+    for (prefix, stats) in sections:
+        for (key, value) in sorted(stats.items()):
+            if (isinstance(value, (int, float))  and  not isinstance(value, bool)):
+                lines.append(prefix + re.sub("([A-Z])", lambda m: "_" + m.group(1).lower(), key) + " " + repr(value))
+    lines.append("foosball_coalescing_in_flight " + str(coalescing["inFlight"]))
+    for field in ("executed", "coalesced"):
+        for (command, count) in sorted(coalescing[field].items()):
+            lines.append("foosball_coalescing_" + field + _labelString([ ("command", command) ]) + " " + str(count))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+## Slack's request signing:  X-Slack-Signature is "v0=" + HMAC-SHA256(signingSecret, "v0:<timestamp>:<raw body>").  Only
+## checked when slack.signingSecret is set; requests more than five minutes old are refused to stop replays.
+def _slackSignatureOk():
+    secret = _g_config["slack"].get("signingSecret", "")
+    if (len(secret) == 0):
+        return True
+    timestamp = request.headers.get("X-Slack-Request-Timestamp", "")
+    try:
+        if (abs(time.time() - int(timestamp)) > 300):
+            return False
+    except ValueError:
+        return False
+    base = b"v0:" + timestamp.encode("utf-8") + b":" + request.get_data()     ## Read the raw body before request.form.
+    expected = "v0=" + hmac.new(secret.encode("utf-8"), base, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, str(request.headers.get("X-Slack-Signature", "")))
+
+
+## For the web routes that rebuild or reload server state:  the same checks /slack makes, so the caller must send
+## slack.teamPayloadToken as "token" (and sign the request, when slack.signingSecret is set).
+def _adminRequestOk():
+    if (not _slackSignatureOk()):
+        return False
+    return hmac.compare_digest(str(request.values.get("token", "")), str(_g_config["slack"]["teamPayloadToken"]))
+
+
 @app.route("/slack", methods=['POST'])              ## Route used by Slack
 def slack():
     _readConfigFile()
+    if (not _slackSignatureOk()):
+        abort(401)
     if (request.form['token'] != _g_config["slack"]["teamPayloadToken"]  or  request.form['team_domain'] != _g_config["slack"]["teamDomain"]):
         abort(401)
     _enableLogging()
+    _catchUpRatings()
     commandText = request.form['text']
     commandArgs = commandText.split()
     command = commandArgs[0]
     if (command == u"help"):
-        help = "Valid commands:  help, newPlayer, stats, game, recent, changePlayer.\n"
+        help = "Valid commands:  help, newPlayer, stats, teams, ratings, game, recent, changePlayer, rebuildStats.\n"
         help += "\n"
         help += "To add a new player:  /foosball newPlayer [playerName]\n"
         help += "To change a player's name:  /foosball changePlayer [playerName] [newName]\n"
         help += "\n"
         help += "To get stats for all players:  /foosball stats\n"
         help += "To get stats for a player:  /foosball stats [playerName]\n"
-        #help += "To get stats for a team:  /foosball stats [playerName1]+[playerName2]\n"
+        help += "To get stats for a team:  /foosball stats [playerName1]+[playerName2]\n"
         help += "To get stats for a player against another player:  /foosball stats [playerName1] [playerName2]\n"
+        help += "To get stats for a team against another team:  /foosball stats [playerName1]+[playerName2] [playerName3]+[playerName4]\n"
+        help += "To get the team leaderboard:  /foosball teams [numberOfTeams]\n"
+        help += "To get the skill rating leaderboard:  /foosball ratings\n"
         help += "\n"
         help += "To add a 1-1 game record:  /foosball game steve(red):5 adriano(black):3\n"
         help += "To add a 2-2 game record:  /foosball game steve(redD)+daniel(redO):5 matt(blackO)+adriano(blackD):3\n"
         help += "\n"
         help += "To see all games added in last 24 hours:  /foosball recent\n"
+        help += "To limit stats or recent to a period, add days:N, thisMonth, from:YYYY-MM-DD and/or to:YYYY-MM-DD, e.g.:  /foosball stats thisMonth\n"
+        help += "To regenerate the stats summary and ratings from all games:  /foosball rebuildStats\n"
         help += "There's also:  /foosball trash\n"
         help += "\n"
         return help
 
     user = request.form['user_name']
-    db = _connectDB()
-    
-    try:
-        if (command == u"stats"):
-            return _stats(commandArgs, db, user)
-        elif (command == u"recent"):
-            return _recent(commandArgs, db, user)
-        elif (command == u"game"):
-            return _game(commandArgs, db, user)
-        elif (command == u"newPlayer"):
-            return _newPlayer(commandArgs, db, user)
-        elif (command == u"changePlayer"):
-            return _changePlayer(commandArgs, db, user)
-        elif (command == u"trash"):
-            return _trash(commandArgs, db, user)
-        else:
-            return "Invalid command.  Use \"/foosball help\"."
-    except Exception as e:
-        app.logger.error("Caught exception in slack():  " + str(e))
-        return "Error!"
-    finally:
-        db.close()
+    if ("response_url" in request.form  and  _shouldDefer(commandArgs)):
+        if (_deferredWorkers().submit(_runDeferredSlackCommand, commandArgs, user, request.form['response_url'])):
+            return "Working on it..."
+    return _runSlackCommand(commandArgs, user)
 
 
 
@@ -0,0 +1,157 @@
+## Shared fixtures.  `server` is statsServer, re-imported for each test and configured against an empty database on
+## each storage backend in turn:  SQLite in a scratch file, and MySQL when FOOSBALL_TEST_MYSQL_CONFIG names a config
+## file whose database may be wiped (skipped otherwise).  Outbound Slack messages go to `slackStub`, a local HTTP
+## server that records what it's sent.
+##
+## Usage:  python -m pytest -q tests
+##         FOOSBALL_TEST_MYSQL_CONFIG=/path/to/scratch.cfg python -m pytest -q tests
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+try:
+    from importlib import reload
+except ImportError:
+    pass                        ## Python 2's is a builtin.
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import statsServer
+import league
+
+TOKEN = "test-token"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+## Answers each POST (after `delay` seconds) with the next queued (status, body, headers) response, or 200 {"ok": true}
+## once they run out, and keeps the fields (form or JSON) and path of every call it answered with ok:  chat.postMessage,
+## or a deferred command's response_url.
+class SlackStub(object):
+    def __init__(self):
+        stub = self
+        self.cond = threading.Condition()
+        self.responses = []
+        self.messages = []
+        self.calls = 0
+        self.delay = 0.0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                time.sleep(stub.delay)
+                with stub.cond:
+                    stub.calls += 1
+                    (status, reply, headers) = stub.responses.pop(0) if (len(stub.responses) > 0) else (200, { "ok" : True }, {})
+                reply = json.dumps(reply).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                for (name, value) in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(reply)
+                if (status == 200  and  b'"ok": true' in reply):
+                    with stub.cond:
+                        if (self.headers.get("Content-Type", "").startswith("application/json")):
+                            message = json.loads(body)
+                        else:
+                            message = dict((key, values[0]) for (key, values) in parse_qs(body).items())
+                        message["path"] = self.path
+                        stub.messages.append(message)
+                        stub.cond.notify_all()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/api/chat.postMessage"
+        thread = threading.Thread(target=self.server.serve_forever, name="SlackStub")
+        thread.daemon = True
+        thread.start()
+
+    ## Waits up to timeout seconds for count messages; returns their texts.
+    def waitForMessages(self, count, timeout = 5.0):
+        deadline = time.time() + timeout
+        with self.cond:
+            while (len(self.messages) < count  and  time.time() < deadline):
+                self.cond.wait(deadline - time.time())
+            return [ message["text"] for message in self.messages ]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def slackStub():
+    stub = SlackStub()
+    yield stub
+    stub.close()
+
+
+def _databaseConfig(backend, tmpdir):
+    if (backend == "sqlite"):
+        return { "backend" : "sqlite", "sqliteFile" : os.path.join(tmpdir, "foosball.db"), "poolSize" : 4 }
+    configFile = os.environ.get("FOOSBALL_TEST_MYSQL_CONFIG", "")
+    if (len(configFile) == 0):
+        pytest.skip("set FOOSBALL_TEST_MYSQL_CONFIG to a config whose MySQL database can be wiped")
+    if (statsServer.MySQLdb is None):
+        pytest.skip("MySQLdb is not installed")
+    with open(configFile) as f:
+        dbConfig = json.load(f)["database"]
+    dbConfig["backend"] = "mysql"
+    return dbConfig
+
+
+@pytest.fixture(params=[ "sqlite", "mysql" ])
+def server(request, tmpdir, slackStub):
+    tmpdir = str(tmpdir)
+    config = { "logging" : { "logfile" : os.path.join(tmpdir, "foosball.log"), "level" : 30 },
+               "database" : _databaseConfig(request.param, tmpdir),
+               "slack" : { "apiToken" : "xoxb-test", "channel" : "Foosball", "postAsUser" : "FoosBot",
+                           "teamDomain" : "test", "teamPayloadToken" : TOKEN, "signingSecret" : "",
+                           "apiURL" : slackStub.url, "maxRetries" : 2, "retryBackoff" : 0.01, "deferredCommands" : [] },
+               "insultFile" : os.path.join(ROOT, "insults.txt"),
+               "snapshot" : { "file" : "" } }
+    configFile = os.path.join(tmpdir, "foosball.cfg")
+    with open(configFile, "w") as f:
+        json.dump(config, f)
+    reload(statsServer)                   ## Starts from empty caches, pool and Slack queue.
+    statsServer._g_configFile = configFile
+    statsServer._readConfigFile()
+    try:
+        db = statsServer._connectDB()
+    except Exception as e:
+        if (request.param == "mysql"):
+            pytest.skip("can't connect to the MySQL test database:  " + str(e))
+        raise
+    try:
+        league.createSchema(db)
+    finally:
+        db.close()
+    statsServer._startup()
+    yield statsServer
+    statsServer._flushSlackQueue()
+    statsServer._connectionPool().closeIdle()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
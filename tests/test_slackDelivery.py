@@ -0,0 +1,77 @@
+## Outbound Slack messages go through the background delivery queue to the local stub (see conftest.py).
+
+import hashlib
+import hmac
+import time
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+import pytest
+
+from conftest import TOKEN
+
+
+@pytest.fixture
+def sqliteServer(server):
+    if (server._storage().__class__.__name__ != "SQLiteStorage"):
+        pytest.skip("delivery doesn't depend on the storage backend")
+    return server
+
+
+def test_messagesDeliveredInOrder(sqliteServer, client, slackStub):
+    client.post("/player", data={ "targetName" : "alice" })
+    client.post("/player", data={ "targetName" : "bob" })
+    assert slackStub.waitForMessages(2) == [ "a web user added new player:  alice\n", "a web user added new player:  bob\n" ]
+    assert slackStub.messages[0]["channel"] == "Foosball"  and  slackStub.messages[0]["token"] == "xoxb-test"
+
+
+def test_requestDoesNotWaitForSlack(sqliteServer, client, slackStub):
+    slackStub.delay = 1.0
+    start = time.time()
+    assert client.post("/player", data={ "targetName" : "alice" }).data == b"Added player alice."
+    assert time.time() - start < slackStub.delay
+    assert slackStub.waitForMessages(1) == [ "a web user added new player:  alice\n" ]
+
+
+def test_retriesServerErrorsAndRateLimits(sqliteServer, slackStub):
+    slackStub.responses.extend([ (500, { "ok" : False }, {}), (429, { "ok" : False }, { "Retry-After" : "0" }) ])
+    sqliteServer._postSlackMessage("hello")
+    assert slackStub.waitForMessages(1) == [ "hello\n" ]
+    sqliteServer._flushSlackQueue()
+    stats = sqliteServer._slackQueue().statistics()
+    assert (stats["sent"], stats["retries"], stats["rateLimited"], stats["pending"]) == (1, 2, 1, 0)
+
+
+def test_givesUpAfterMaxRetries(sqliteServer, slackStub):
+    slackStub.responses.extend([ (500, { "ok" : False }, {}) ] * 3)
+    sqliteServer._postSlackMessage("lost")
+    sqliteServer._postSlackMessage("delivered")
+    assert slackStub.waitForMessages(1) == [ "delivered\n" ]
+    sqliteServer._flushSlackQueue()
+    assert slackStub.calls == 4
+    assert sqliteServer._slackQueue().statistics()["failed"] == 1
+
+
+def test_deferredCommandPostsToResponseURL(sqliteServer, client, slackStub):
+    sqliteServer._g_config["slack"]["deferredCommands"] = [ "ratings" ]
+    sqliteServer._g_config["slack"]["signingSecret"] = "test-secret"
+    client.post("/player", data={ "targetName" : "alice" })
+    client.post("/player", data={ "targetName" : "bob" })
+    client.post("/game", data={ "side1" : "alice(red):5", "side2" : "bob(black):3" })
+    sqliteServer._flushSlackQueue()
+    announced = len(slackStub.messages)
+    responseURL = slackStub.url.replace("/api/chat.postMessage", "/response")
+    body = urlencode({ "token" : TOKEN, "team_domain" : "test", "user_name" : "carol", "command" : "/foosball", \
+                       "text" : "ratings", "response_url" : responseURL })
+    timestamp = str(int(time.time()))
+    signature = "v0=" + hmac.new(b"test-secret", ("v0:" + timestamp + ":" + body).encode("utf-8"), hashlib.sha256).hexdigest()
+    headers = { "X-Slack-Request-Timestamp" : timestamp, "X-Slack-Signature" : signature }
+    assert client.post("/slack", data=body, headers=headers, content_type="application/x-www-form-urlencoded").data == b"Working on it..."
+    slackStub.waitForMessages(announced + 1)
+    deferred = slackStub.messages[announced:]
+    assert [ message["path"] for message in deferred ] == [ "/response" ]
+    assert deferred[0]["response_type"] == "ephemeral"  and  deferred[0]["text"].startswith("   rank   rating   games\nalice:\t1\t")
+    unsigned = client.post("/slack", data=body, content_type="application/x-www-form-urlencoded")
+    assert unsigned.status_code == 401
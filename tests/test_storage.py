@@ -0,0 +1,177 @@
+## The web API end to end on each storage backend (see conftest.py):  players, games, stats, recent games, bulk import,
+## export, ratings and rebuildStats.
+
+import json
+
+from conftest import TOKEN
+
+
+def addPlayers(client, *names):
+    for name in names:
+        assert client.post("/player", data={ "targetName" : name }).data.decode("utf-8") == "Added player " + name + "."
+
+
+def recordGame(client, side1, side2):
+    assert client.post("/game", data={ "side1" : side1, "side2" : side2 }).data == b"Game recorded."
+
+
+def playerStats(client, name):
+    stats = json.loads(client.get("/stats", query_string={ "playerName" : name }).data)["stats"]
+    return dict((category["category"], category["categoryStats"]) for category in stats)
+
+
+def summaryTables(server):
+    db = server._connectDB()
+    try:
+        cursor = db.cursor()
+        tables = {}
+        for (table, key) in (("PlayerSummary", "playerId, rel, rval"), ("PairSummary", "playerId, rel, otherId"), \
+                             ("TeamSummary", "player1Id, player2Id, defenseId"), \
+                             ("TeamVersusSummary", "player1Id, player2Id, opponent1Id, opponent2Id"), \
+                             ("GameParticipant", "gameId, playerId, color, position"), ("Rating", "playerId")):
+            cursor.execute("SELECT * FROM " + table + " ORDER BY " + key)
+            tables[table] = [ tuple(round(v, 6) if (isinstance(v, float)) else str(v) for v in row) for row in cursor.fetchall() ]
+        db.rollback()
+        return tables
+    finally:
+        db.close()
+
+
+def test_newPlayer(client):
+    addPlayers(client, "alice", "bob")
+    assert client.post("/player", data={ "targetName" : "ALICE" }).data == b"User already exists."
+    assert client.post("/player", data={ "targetName" : "bob", "changeName" : "robert" }).data == b"Changed player 'bob' to 'robert'."
+    assert sorted(json.loads(client.get("/players").data)["players"]) == [ "alice", "robert" ]
+
+
+def test_unusualNames(client):
+    names = [ u"Zo\u00eb", "o'brien", "x\"); DROP TABLE Player; --" ]
+    addPlayers(client, *names)
+    recordGame(client, names[0] + "(red):5", names[1] + "(black):3")
+    assert sorted(json.loads(client.get("/players").data)["players"]) == sorted(names)
+    assert playerStats(client, names[0])["overall"]["wins"] == 1
+
+
+def test_gameAndStats(client):
+    addPlayers(client, "alice", "bob", "carol", "dave")
+    recordGame(client, "alice(red):5", "bob(black):3")
+    recordGame(client, "alice(black):2", "bob(red):5")
+    recordGame(client, "alice(redD)+carol(redO):5", "bob(blackD)+dave(blackO):5")
+    assert client.post("/game", data={ "side1" : "alice(red):5", "side2" : "nobody(black):3" }).data != b"Game recorded."
+    stats = playerStats(client, "alice")
+    assert stats["overall"] == { "gamesPlayed" : 3, "wins" : 1, "losses" : 1, "ties" : 1, "goalDifferential" : -1 }
+    assert stats["as red"] == { "gamesPlayed" : 2, "wins" : 1, "losses" : 0, "ties" : 1, "goalDifferential" : 2 }
+    assert stats["as black"] == { "gamesPlayed" : 1, "wins" : 0, "losses" : 1, "ties" : 0, "goalDifferential" : -3 }
+    assert stats["solo"]["gamesPlayed"] == 2
+    for player in json.loads(client.get("/stats").data)["allStats"]:
+        categories = [ category["category"] for category in player["stats"] ]
+        assert categories == [ c for c in ("overall", "as red", "as black", "solo") if (c in categories) ]
+    pair = json.loads(client.get("/stats", query_string={ "playerName1" : "alice", "playerName2" : "bob" }).data)
+    assert [ s["categoryStats"]["gamesPlayed"] for s in pair["pairStats"] ] == [ 2, 0 ]
+
+
+def test_recent(client):
+    addPlayers(client, "alice", "bob")
+    recordGame(client, "alice(red):5", "bob(black):3")
+    recordGame(client, "bob(red):1", "alice(black):5")
+    games = json.loads(client.get("/recent").data)["games"]
+    assert len(games) == 2
+    assert set((game["side1"]["defense"], game["side2"]["defense"]) for game in games) == set([ ("alice", "bob"), ("bob", "alice") ])
+    assert all(game["addedBy"] == "a web user" for game in games)
+
+
+def test_bulkImport(client):
+    addPlayers(client, "alice", "bob", "carol")
+    bad = "side1,side2,timestamp\nalice(red):5,bob(black):3\nalice(red):5,zed(black):1\n"
+    result = json.loads(client.post("/games/bulk?format=csv", data=bad).data)
+    assert result["recorded"] == 0  and  result["errors"][0]["line"] == 3
+    good = "alice(red):5,bob(black):3,2020-01-02 03:04:05\ncarol(red):1,bob(black):5\nalice(redD)+carol(redO):4,bob(black):4\n"
+    assert json.loads(client.post("/games/bulk?format=csv", data=good).data) == { "recorded" : 3, "errors" : [] }
+    ndjson = json.dumps({ "side1" : "bob(red):5", "side2" : "alice(black):0" }) + "\n"
+    assert json.loads(client.post("/games/bulk", data=ndjson).data)["recorded"] == 1
+    assert playerStats(client, "bob")["overall"]["gamesPlayed"] == 4
+    assert playerStats(client, "alice")["overall"] == { "gamesPlayed" : 3, "wins" : 1, "losses" : 1, "ties" : 1, "goalDifferential" : -3 }
+
+
+def test_bulkImportUnicodeNames(client):
+    names = [ u"Zo\u00eb", u"J\u00fcrgen", u"\u674e\u96f7" ]
+    addPlayers(client, *names)
+    csvGames = u"%s(red):5,%s(black):3\n%s(redD)+%s(redO):2,%s(black):2\n" % (names[0], names[1], names[1], names[2], names[0])
+    assert json.loads(client.post("/games/bulk?format=csv", data=csvGames.encode("utf-8")).data) == { "recorded" : 2, "errors" : [] }
+    assert playerStats(client, names[0])["overall"] == { "gamesPlayed" : 2, "wins" : 1, "losses" : 0, "ties" : 1, "goalDifferential" : 2 }
+    exported = client.get("/games", query_string={ "format" : "csv" }).data.decode("utf-8").splitlines()
+    assert [ line.split(",")[3:5] for line in exported[1:] ] == [ [ names[0], names[0] ], [ names[1], names[2] ] ]
+
+
+def test_export(client):
+    addPlayers(client, "alice", "bob")
+    for score in range(5):
+        recordGame(client, "alice(red):" + str(score), "bob(black):3")
+    lines = client.get("/games", query_string={ "format" : "csv" }).data.decode("utf-8").splitlines()
+    assert lines[0] == "gameid,timestamp,addedBy,redDefense,redOffense,redScore,blackDefense,blackOffense,blackScore"
+    assert [ line.split(",")[5] for line in lines[1:] ] == [ "0", "1", "2", "3", "4" ]
+    firstPage = [ json.loads(line) for line in client.get("/games", query_string={ "limit" : 2 }).data.decode("utf-8").splitlines() ]
+    nextPage = [ json.loads(line) for line in client.get("/games", query_string={ "after" : firstPage[-1]["gameid"] }).data.decode("utf-8").splitlines() ]
+    assert [ game["side1"]["score"] for game in firstPage + nextPage ] == [ 0, 1, 2, 3, 4 ]
+    assert client.get("/games", query_string={ "limit" : 0 }).status_code == 400
+
+
+def test_ratings(client):
+    addPlayers(client, "alice", "bob", "carol")
+    recordGame(client, "alice(red):5", "bob(black):3")
+    recordGame(client, "alice(red):5", "carol(black):3")
+    recordGame(client, "bob(red):3", "carol(black):3")
+    leaders = json.loads(client.get("/ratings").data)["ratings"]
+    assert [ leader["player"] for leader in leaders ][0] == "alice"
+    assert [ leader["gamesRated"] for leader in leaders ] == [ 2, 2, 2 ]
+    assert leaders[0]["rating"] > 1500.0 > leaders[-1]["rating"]
+    assert [ leader["rating"] for leader in leaders ] == sorted((leader["rating"] for leader in leaders), reverse=True)
+
+
+def test_rebuildStats(server, client):
+    addPlayers(client, "alice", "bob", "carol", "dave")
+    recordGame(client, "alice(red):5", "bob(black):3")
+    recordGame(client, "alice(redD)+carol(redO):2", "bob(blackD)+dave(blackO):5")
+    client.post("/games/bulk?format=csv", data="dave(red):5,carol(black):5\ncarol(redD)+dave(redO):1,alice(black):0\n")
+    incremental = summaryTables(server)
+    statsBefore = client.get("/stats").data
+    assert client.post("/stats/rebuild").status_code == 401
+    assert client.post("/stats/rebuild", data={ "token" : TOKEN }).data == b"Stats rebuilt."
+    assert summaryTables(server) == incremental
+    assert client.get("/stats").data == statsBefore
+
+
+def test_ratingsCatchUp(server, client, monkeypatch):
+    addPlayers(client, "alice", "bob")
+    recordGame(client, "alice(red):5", "bob(black):3")
+    db = server._connectDB()
+    try:
+        db.cursor().execute("INSERT INTO Game (timestamp, recordedBy, redScore, blackScore, redDefense, redOffense, blackDefense, blackOffense) " \
+                            "VALUES ('2020-01-01 00:00:00', 'import', 5, 0, 1, 1, 2, 2)")
+        db.commit()
+    finally:
+        db.close()
+    server._connectionPool().ratingsCaughtUp = False
+    rebuildRatings = server._rebuildRatings
+    monkeypatch.setattr(server, "_rebuildRatings", lambda db, fromScratch = True: False)
+    slackForm = { "token" : TOKEN, "team_domain" : "test", "user_name" : "carol", "text" : "ratings" }
+    client.post("/slack", data=slackForm)
+    assert not server._connectionPool().ratingsCaughtUp                 ## Failed, so tried again next time.
+    monkeypatch.setattr(server, "_rebuildRatings", rebuildRatings)
+    client.post("/slack", data=slackForm)
+    assert server._connectionPool().ratingsCaughtUp
+    assert [ leader["gamesRated"] for leader in json.loads(client.get("/ratings").data)["ratings"] ] == [ 2, 2 ]
+
+
+def test_configReloadClosesOldPool(server, client):
+    addPlayers(client, "alice")
+    oldPool = server._connectionPool()
+    db = server._connectDB()
+    dbConfig = dict(server._g_config["database"])
+    dbConfig["poolSize"] = int(dbConfig.get("poolSize", 5)) + 1
+    server._g_config["database"] = dbConfig
+    assert server._connectionPool() is not oldPool
+    assert oldPool.statistics()["idle"] == 0
+    db.close()                                                          ## Checked in after the reload.
+    assert (oldPool.statistics()["open"], oldPool.statistics()["idle"]) == (0, 0)
+    assert json.loads(client.get("/players").data)["players"] == [ "alice" ]